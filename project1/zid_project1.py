@@ -1,11 +1,23 @@
 """ zid_project1.py
 
 """
+import collections
+from concurrent.futures import ProcessPoolExecutor
+import gzip
 import json
+import mmap
 import os
 
+import numpy as np
+
 import toolkit_config as cfg
 
+# zstd compression requires the zstandard package
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 # ----------------------------------------------------------------------------
 # Location of files and folders
 # Instructions:
@@ -164,6 +176,197 @@ def line_to_dict(line):
     return dict
 
 
+# ----------------------------------------------------------------------------
+#   Vectorized parsing of ".dat" files
+# ----------------------------------------------------------------------------
+def dat_dtype():
+    """ Returns a numpy structured dtype with one fixed-width bytes field
+    per column in `COLUMNS`, with the width in `COLWIDTHS`
+    """
+    return np.dtype([(col, f'S{COLWIDTHS[col]}') for col in COLUMNS])
+
+
+def parse_dat(tic, col_lst=None, datdir=None):
+    """ Returns the columns of the ".dat" file for the ticker `tic` as
+    arrays, decoding the whole file at once.
+
+    Instead of slicing each line with `line_to_dict`, the lines are stored in
+    a single fixed-width bytes array which is then viewed as a structured
+    array with one field per column (see `dat_dtype`).
+
+    Parameters
+    ----------
+    tic : str
+        Ticker symbol, in lower case.
+
+    col_lst : list, optional
+        A list containing column names (as strings). If None, all the
+        columns in `COLUMNS` are returned
+
+    datdir : str, optional
+        Folder with the ".dat" files. Default is `DATDIR`
+
+    Returns
+    -------
+    dict
+        A dictionary with format {<col> : <array>} where each <array> is a
+        numpy array of strings, with one element per line of the file.
+        Element i is the same as `line_to_dict(read_dat(tic)[i])[<col>]`
+
+    """
+    if col_lst is None:
+        col_lst = COLUMNS
+    cols = _parse_dat_bytes((tic, col_lst, datdir))
+    return {col: cols[col].astype(str) for col in col_lst}
+
+
+def _parse_dat_bytes(args):
+    """ Given a tuple (tic, col_lst, datdir), returns a dictionary
+    {<col> : <array>} with the columns of the ".dat" file of `tic` as
+    fixed-width bytes arrays (one byte per character). See `parse_dat`
+    """
+    tic, col_lst, datdir = args
+    if datdir is None:
+        datdir = DATDIR
+    pth = os.path.join(datdir, f'{tic}_prc.dat')
+    with open(pth, mode='rb') as fobj:
+        lines = fobj.read().splitlines()
+
+    dtype = dat_dtype()
+    if len(lines) == 0:
+        return {col: np.array([], dtype=dtype[col]) for col in col_lst}
+    # Same as `read_dat`: remove spaces at the start and end of each line.
+    # Shorter lines are padded with null bytes, which are not part of the
+    # values of the fields, and longer lines are truncated
+    lines = np.char.strip(np.array(lines))
+    recs = lines.astype(f'S{dtype.itemsize}').view(dtype)
+    return {col: recs[col].copy() for col in col_lst}
+
+
+# ----------------------------------------------------------------------------
+#   Random access to ".dat" files
+# ----------------------------------------------------------------------------
+class DatFile:
+    """ Memory-mapped, read-only view of the ".dat" file for a ticker.
+
+    Every line of a ".dat" file has the same width (the sum of `COLWIDTHS`)
+    followed by a newline, so the location of line i is i * <record
+    length>. Lines are only read when they are accessed, and the operating
+    system only loads the pages of the file holding these lines.
+
+    - len(dat) is the number of lines
+    - dat[i] is the dictionary `line_to_dict(read_dat(tic)[i])`
+    - dat[i:j] is a list of these dictionaries
+    - dat.date_range(start, end) returns the lines with a date between
+      `start` and `end`, found by binary search on the `Date` column (the
+      lines must be sorted by date, as in the files provided)
+
+    Usage
+    -----
+
+    >> with DatFile('aapl') as dat:
+    >>     first = dat[0]
+    >>     month = dat.date_range('2020-03-01', '2020-03-31')
+
+    """
+
+    def __init__(self, tic, datdir=None):
+        if datdir is None:
+            datdir = DATDIR
+        self.pth = os.path.join(datdir, f'{tic}_prc.dat')
+        self.width = sum(COLWIDTHS[col] for col in COLUMNS)
+        self._fobj = open(self.pth, mode='rb')
+        size = os.fstat(self._fobj.fileno()).st_size
+        if size == 0:
+            # An empty file cannot be mapped
+            self._buf = b''
+            self.reclen = self.width + 1
+            self._n = 0
+        else:
+            self._buf = mmap.mmap(self._fobj.fileno(), 0,
+                    access=mmap.ACCESS_READ)
+            # Lines end with "\n" or "\r\n"
+            eol = 2 if self._buf[self.width:self.width + 1] == b'\r' else 1
+            self.reclen = self.width + eol
+            # The last line may not end with a newline
+            self._n = (size + eol) // self.reclen
+            if size not in (self._n * self.reclen,
+                    self._n * self.reclen - eol):
+                self.close()
+                raise Exception(f'{self.pth} does not have fixed-width lines')
+
+        # Location of the `Date` field within a line
+        self._date_start = sum(COLWIDTHS[col]
+                for col in COLUMNS[:COLUMNS.index('Date')])
+        self._date_end = self._date_start + COLWIDTHS['Date']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        """ Closes the file """
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
+        self._fobj.close()
+
+    def __len__(self):
+        return self._n
+
+    def line(self, i):
+        """ Returns line `i`, as an element of the list returned by
+        `read_dat`
+        """
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError(f'Line {i} out of range')
+        start = i * self.reclen
+        return self._buf[start:start + self.width].decode('ascii').strip()
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [line_to_dict(self.line(i))
+                    for i in range(*key.indices(self._n))]
+        return line_to_dict(self.line(key))
+
+    def date(self, i):
+        """ Returns the date of line `i`, e.g. "2020-03-02" """
+        start = i * self.reclen
+        value = self._buf[start + self._date_start:start + self._date_end]
+        return value.decode('ascii').strip()
+
+    def _bisect(self, date, side='left'):
+        """ Position of `date` among the sorted dates of the lines """
+        lo, hi = 0, self._n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self.date(mid)
+            if value < date or (side == 'right' and value == date):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def date_slice(self, start=None, end=None):
+        """ Returns a slice with the lines with a date between `start` and
+        `end` (strings formatted as 'YYYY-MM-DD', both included). If `start`
+        or `end` is None, the range is open on that side
+        """
+        first = 0 if start is None else self._bisect(start, side='left')
+        last = self._n if end is None else self._bisect(end, side='right')
+        return slice(first, max(first, last))
+
+    def date_range(self, start=None, end=None):
+        """ Returns a list with the dictionaries (see `line_to_dict`) of the
+        lines with a date between `start` and `end` (see `date_slice`)
+        """
+        return self[self.date_slice(start, end)]
+
+
 # ----------------------------------------------------------------------------
 #   Please complete the body of this function so it matches its docstring
 #   description. See the assessment description file for more information.
@@ -198,8 +401,6 @@ def verify_tickers(tic_exchange_dic, tickers_lst=None):
                'Tsm' is not a key of tic_exchange_dic.
 
     """
-    pth = TICPATH
-    tic_exchange_dic = get_tics(pth)
     if tickers_lst is not None:
         if tickers_lst == []:
             raise Exception("tickers_lst is an empty list.")
@@ -252,7 +453,8 @@ def verify_cols(col_lst=None):
 #   Please complete the body of this function so it matches its docstring
 #   description. See the assessment description file for more information.
 # ----------------------------------------------------------------------------
-def create_data_dict(tic_exchange_dic, tickers_lst=None, col_lst=None):
+def create_data_dict(tic_exchange_dic, tickers_lst=None, col_lst=None,
+        max_workers=None):
     """Returns a dictionary containing the data for the tickers specified in tickers_lst.
         An Exception is raised if any of the tickers provided in tickers_lst or any of the
         column names provided in col_lst are invalid.
@@ -268,6 +470,10 @@ def create_data_dict(tic_exchange_dic, tickers_lst=None, col_lst=None):
         col_lst : list, optional
             A list containing column names (as strings)
 
+        max_workers : int, optional
+            Number of worker processes used to parse the ".dat" files (see
+            `iter_data`). If None (default), files are parsed in this process
+
         Returns
         -------
         dict
@@ -296,49 +502,141 @@ def create_data_dict(tic_exchange_dic, tickers_lst=None, col_lst=None):
         ----------------
         - To check if tickers_lst contains any invalid tickers, you can call `verify_tickers`
         - To check if col_lst contains any invalid column names, you can call `verify_cols`
-        - This function should call the `read_dat` and `line_to_dict` functions
+        - The lines of each ".dat" file are parsed at once by `parse_dat`,
+          which returns the same values as `read_dat` and `line_to_dict`
 
     """
-    verify_tickers(tickers_lst)
+    # NOTE: Each ticker has its own dictionary and its own list of lines
+    dict = {}
+    for tic, exchange, records in iter_data(tic_exchange_dic, tickers_lst,
+            col_lst, max_workers=max_workers):
+        dict[tic] = {'exchange': exchange, 'data': list(records)}
+    return dict
+
+
+# ----------------------------------------------------------------------------
+#   Streaming the data one ticker at a time
+# ----------------------------------------------------------------------------
+def _iter_records(tic, col_lst, cols=None):
+    """ Yields the dictionaries {<col> : <value>} of the lines of the ".dat"
+    file for `tic`. Unless the columns `cols` are given (as bytes arrays,
+    see `_parse_dat_bytes`, or string arrays, see `parse_dat`), the file is
+    only parsed once the iteration starts. The columns are released when
+    the iteration ends
+    """
+    if cols is None:
+        cols = _parse_dat_bytes((tic, col_lst, None))
+    values = zip(*[cols[col].astype(str, copy=False).tolist()
+        for col in col_lst])
+    del cols
+    for row in values:
+        yield {col: value for col, value in zip(col_lst, row)}
+
+
+def _iter_parallel(tic_exchange_dic, tickers_lst, col_lst, max_workers,
+        max_pending=None):
+    """ Same as `iter_data`, but the ".dat" files are parsed and decoded by
+    a pool of `max_workers` processes (see `parse_dat`). Workers return the
+    columns as string arrays, which are much cheaper to send back than lists
+    of dictionaries, and the dictionaries are built during the iteration
+    (see `_iter_records`). At most `max_pending` files (2 * max_workers by
+    default) are submitted ahead of the iteration, so the parent process
+    holds the columns of a bounded number of tickers
+    """
+    if max_pending is None:
+        max_pending = 2 * max_workers
+    pending = collections.deque()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for tic in tickers_lst:
+                pending.append((tic, executor.submit(parse_dat, tic,
+                    col_lst, DATDIR)))
+                if len(pending) >= max_pending:
+                    tic, future = pending.popleft()
+                    yield tic, tic_exchange_dic[tic], _iter_records(tic,
+                            col_lst, future.result())
+            # Results are returned in the order of `tickers_lst`
+            while len(pending) > 0:
+                tic, future = pending.popleft()
+                yield tic, tic_exchange_dic[tic], _iter_records(tic, col_lst,
+                        future.result())
+        finally:
+            # The iteration may stop early
+            for tic, future in pending:
+                future.cancel()
+
+
+def iter_data(tic_exchange_dic, tickers_lst=None, col_lst=None,
+        max_workers=None):
+    """ Streaming version of `create_data_dict`: yields the data of one
+    ticker at a time, so that only the lines of a single ticker are held in
+    memory.
+
+    Parameters
+    ----------
+    tic_exchange_dic, tickers_lst, col_lst
+        See `create_data_dict`
+
+    max_workers : int, optional
+        If larger than one, the ".dat" files are parsed in parallel by this
+        number of worker processes, ahead of the iteration. Tickers are
+        still returned in the order of `tickers_lst`. At most
+        2 * max_workers files are parsed ahead of the ticker being
+        iterated, so the columns of at most that many tickers are held in
+        memory. If None (default), each file is parsed in this process when
+        its records are first iterated
+
+    Returns
+    -------
+    iterator
+        An iterator over tuples (<tic>, <exchange>, <records>), one for each
+        ticker in `tickers_lst`, where <records> is an iterator over the
+        dictionaries in the `data` list of this ticker (see
+        `create_data_dict`). The ".dat" file of a ticker is read when its
+        records are first iterated.
+
+    """
+    # Invalid tickers or columns raise an Exception here, not during the
+    # iteration
+    verify_tickers(tic_exchange_dic, tickers_lst)
     verify_cols(col_lst)
     if tickers_lst is None:
         tickers_lst = list(tic_exchange_dic.keys())
     if col_lst is None:
         col_lst = COLUMNS
-
-    dict = {}
-    tic_exchange_data_dict = {}
-    data = []
-    for tic in tickers_lst:
-        tic_exchange_data_dict['exchange'] = tic_exchange_dic[tic]
-        lines = read_dat(tic)
-        for line in lines:
-            data_dic = {}
-            for col in col_lst:
-                data_dic[col] = line_to_dict(line)[col]
-            data.append(data_dic)
-        tic_exchange_data_dict['data'] = data
-        dict[tic] = tic_exchange_data_dict
-    return dict
+    if max_workers is not None and max_workers > 1:
+        return _iter_parallel(tic_exchange_dic, tickers_lst, col_lst,
+                max_workers)
+    return ((tic, tic_exchange_dic[tic], _iter_records(tic, col_lst))
+            for tic in tickers_lst)
 
 
 # ----------------------------------------------------------------------------
 #   Please complete the body of this function so it matches its docstring
 #   description. See the assessment description file for more information.
 # ----------------------------------------------------------------------------
-def create_json(data_dict, pth):
+def create_json(data_dict, pth, compression='infer', lines=False):
     """Saves the data found in the data_dict dictionary into a
         JSON file whose name is specified by pth.
 
         Parameters
         ----------
         data_dict: dict
-            A dictionary returned by the `create_data_dict` function
+            A dictionary returned by the `create_data_dict` function, or the
+            iterator returned by `iter_data` (the data is then written one
+            ticker at a time, without building the whole dictionary)
 
         pth : str
             The complete path to the output JSON file. This is where the file with
             the data will be saved.
 
+        compression : str, optional
+            "gzip", "zstd" or None. If "infer" (default), use gzip for files
+            ending with ".gz", zstd for files ending with ".zst" and no
+            compression otherwise. See `write_json`
+
+        lines : bool, optional
+            If True, save a JSON-lines file instead (see `write_json`)
 
         Returns
         -------
@@ -346,8 +644,99 @@ def create_json(data_dict, pth):
             This function does not return anything
 
     """
-    with open(pth, mode='wt') as fobj:
-        json.dump(data_dict, fobj)
+    write_json(data_dict, pth, compression=compression, lines=lines)
+
+
+# ----------------------------------------------------------------------------
+#   Streaming JSON files
+# ----------------------------------------------------------------------------
+def _open_text(pth, mode, compression='infer'):
+    """ Opens the file `pth` in text mode `mode` ("rt" or "wt"), with the
+    given compression (see `create_json`)
+    """
+    if compression == 'infer':
+        if pth.endswith('.gz'):
+            compression = 'gzip'
+        elif pth.endswith('.zst'):
+            compression = 'zstd'
+        else:
+            compression = None
+    if compression is None:
+        return open(pth, mode=mode, encoding='utf-8')
+    elif compression == 'gzip':
+        # Level 6 is much faster than the default (9), for similar sizes
+        return gzip.open(pth, mode=mode, compresslevel=6, encoding='utf-8')
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise Exception('zstd compression requires the zstandard package')
+        return zstandard.open(pth, mode=mode, encoding='utf-8')
+    raise Exception(f'Unknown compression: {compression}')
+
+
+def _iter_items(data):
+    """ Returns an iterator over tuples (<tic>, <exchange>, <records>) from
+    the output of `create_data_dict` or `iter_data`
+    """
+    if isinstance(data, dict):
+        return ((tic, value['exchange'], value['data'])
+                for tic, value in data.items())
+    return iter(data)
+
+
+def write_json(data, pth, compression='infer', lines=False):
+    """ Writes the data of each ticker to a JSON file, one ticker and one
+    record at a time
+
+    Parameters
+    ----------
+    data : dict, iterator
+        The output of `create_data_dict` or `iter_data`
+
+    pth : str
+        Location of the output file
+
+    compression : str, optional
+        See `create_json`
+
+    lines : bool, optional
+        - If False (default), the file contains the same JSON document as
+          `json.dump(create_data_dict(...))`, i.e.,
+          {<tic>: {"exchange": <exchange>, "data": [<dict_0>, ...]}, ...}
+        - If True, the file contains one JSON document per line and
+          ticker, {"tic": <tic>, "exchange": <exchange>, "data": [...]}, so
+          each ticker can be read separately (see `iter_json_lines`)
+
+    """
+    with _open_text(pth, mode='wt', compression=compression) as fobj:
+        if lines is False:
+            fobj.write('{')
+        for i, (tic, exchange, records) in enumerate(_iter_items(data)):
+            if lines is True:
+                fobj.write(f'{{"tic": {json.dumps(tic)}, ')
+            else:
+                if i > 0:
+                    fobj.write(', ')
+                fobj.write(f'{json.dumps(tic)}: {{')
+            fobj.write(f'"exchange": {json.dumps(exchange)}, "data": [')
+            for j, rec in enumerate(records):
+                if j > 0:
+                    fobj.write(', ')
+                fobj.write(json.dumps(rec))
+            fobj.write(']}\n' if lines is True else ']}')
+        if lines is False:
+            fobj.write('}')
+
+
+def iter_json_lines(pth, compression='infer'):
+    """ Yields tuples (<tic>, <exchange>, <data>) from a JSON-lines file
+    created by `create_json(..., lines=True)`, one ticker at a time
+    """
+    with _open_text(pth, mode='rt', compression=compression) as fobj:
+        for line in fobj:
+            if line.strip() == '':
+                continue
+            doc = json.loads(line)
+            yield doc['tic'], doc['exchange'], doc['data']
 
 
 # ----------------------------------------------------------------------------
@@ -0,0 +1,222 @@
+""" week10_bench.py
+
+Benchmarks for the event study in `week10_slides_main`, using synthetic
+data of increasing size
+
+    toolkit/
+    |   ...
+    |__ webinars/
+    |   |__ week10/
+    |   |   |__ __init__.py
+    |   |   |__ week10_slides_main.py
+    |   |   |__ week10_bench.py           <- This module
+    |   |__ lec_utils.py            <- Required
+
+For each scale (number of tickers, number of years, number of
+recommendations), this module creates synthetic CSV files with prices,
+market returns and recommendations, and then runs the panel version of steps
+2 to 5 (`step2_panel`, `step3_panel`, `step4_panel`, `step5`). Each step is
+run twice: once to measure its wall time and once, under `tracemalloc`, to
+measure its peak memory. The results are saved to a JSON file, e.g.:
+
+    {"created": "2026-10-18T10:00:00",
+     "results": [
+        {"n_tickers": 10, "n_years": 2, "n_recs": 1000, "step": "step2",
+         "seconds": 0.0123, "peak_mb": 1.84, "rows_out": 5010},
+        ...]}
+
+Usage
+-----
+
+>> python -m webinars.week10.week10_bench
+
+"""
+import datetime as dt
+import io
+import json
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from webinars.week10 import week10_slides_main as es
+
+
+# Default scales: (n_tickers, n_years, n_recs)
+SCALES = [
+    (10, 2, 1000),
+    (50, 5, 10000),
+    (200, 10, 100000),
+    ]
+
+FIRMS = ['JP Morgan', 'Deutsche Bank', 'Morgan Stanley', 'Goldman Sachs',
+        'UBS', 'Barclays', 'Citigroup', 'Jefferies', 'Wedbush', 'Baird']
+
+ACTIONS = ['up', 'down', 'main', 'init', 'reit']
+
+
+# ----------------------------------------------------------------------------
+#   Synthetic data
+# ----------------------------------------------------------------------------
+def mk_dates(n_years, start='2000-01-03'):
+    """ Returns a DatetimeIndex with the business days in `n_years` years """
+    start = pd.Timestamp(start)
+    end = start + pd.DateOffset(years=n_years) - pd.Timedelta(days=1)
+    return pd.bdate_range(start, end, name='date')
+
+
+def mk_prc_csvs(n_tickers, dates, seed=None):
+    """ Returns a dictionary {<tic> : <csv>} where each <csv> is a string
+    with the contents of a price file downloaded from Yahoo Finance (see
+    `week10_slides_main.step2`). Prices follow a geometric random walk.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(dates)
+    res = {}
+    for i in range(n_tickers):
+        close = 50 * np.exp(np.cumsum(rng.normal(0.0003, 0.02, n)))
+        spread = np.abs(rng.normal(0, 0.01, n)) * close
+        df = pd.DataFrame({
+            'date': dates,
+            'open': close + rng.normal(0, 0.005, n) * close,
+            'high': close + spread,
+            'low': close - spread,
+            'close': close,
+            'adj_close': close,
+            'volume': rng.integers(10**5, 10**7, n),
+            })
+        res[f'tic{i:04d}'] = df.to_csv(index=False, float_format='%.4f')
+    return res
+
+
+def mk_mkt_csv(dates, seed=None):
+    """ Returns a string with the contents of a CSV file with market
+    returns (see `week10_slides_main.step2`)
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'date': dates, 'mkt': rng.normal(0.0003, 0.01,
+        len(dates))})
+    return df.to_csv(index=False, float_format='%.6f')
+
+
+def mk_rec_csv(tickers, dates, n_recs, dup_frac=0.2, seed=None):
+    """ Returns a string with the contents of a CSV file with `n_recs`
+    recommendations (see `week10_slides_main.step3_panel`), sorted by date
+
+    A fraction `dup_frac` of the recommendations are issued by the same
+    firm, for the same ticker and on the same day as another
+    recommendation, with a later timestamp (e.g. a "main" followed by an
+    "up"), as is common in files downloaded from Yahoo Finance.
+    """
+    rng = np.random.default_rng(seed)
+    n_dups = int(n_recs * dup_frac)
+    n_base = n_recs - n_dups
+
+    # Recommendations issued during trading hours of random days
+    days = rng.choice(dates.to_numpy(), n_base)
+    secs = rng.integers(7 * 3600, 17 * 3600, n_base)
+    df = pd.DataFrame({
+        'date': days + secs.astype('timedelta64[s]'),
+        'ticker': rng.choice(np.asarray(tickers), n_base),
+        'firm': rng.choice(FIRMS, n_base),
+        'action': rng.choice(ACTIONS, n_base),
+        })
+
+    # Same-day duplicates, with random capitalisation of the firm name
+    dups = df.iloc[rng.integers(0, n_base, n_dups)].copy()
+    dups.loc[:, 'date'] = dups.loc[:, 'date'] \
+            + rng.integers(1, 3600, n_dups).astype('timedelta64[s]')
+    upper = rng.random(n_dups) < 0.5
+    dups.loc[upper, 'firm'] = dups.loc[upper, 'firm'].str.upper()
+    dups.loc[:, 'action'] = rng.choice(ACTIONS, n_dups)
+
+    df = pd.concat([df, dups]).sort_values('date', kind='stable')
+    df.loc[:, 'to_grade'] = 'Buy'
+    df.loc[:, 'from_grade'] = 'Hold'
+    cols = ['date', 'ticker', 'firm', 'to_grade', 'from_grade', 'action']
+    return df.loc[:, cols].to_csv(index=False)
+
+
+# ----------------------------------------------------------------------------
+#   Benchmarks
+# ----------------------------------------------------------------------------
+def measure(func, *args, **kargs):
+    """ Runs `func(*args, **kargs)` twice and returns a tuple
+    (<result>, <seconds>, <peak MB>) with the result of the first run, its
+    wall time and the peak memory allocated during the second run
+    """
+    start = time.perf_counter()
+    res = func(*args, **kargs)
+    seconds = time.perf_counter() - start
+    del res
+
+    tracemalloc.start()
+    res = func(*args, **kargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return res, seconds, peak / 2**20
+
+
+def bench_scale(n_tickers, n_years, n_recs, seed=None):
+    """ Creates synthetic data for one scale and benchmarks steps 2 to 5.
+    Returns a list of dictionaries, one per step
+    """
+    dates = mk_dates(n_years)
+    prc_csvs = mk_prc_csvs(n_tickers, dates, seed=seed)
+    mkt_csv = mk_mkt_csv(dates, seed=seed)
+    rec_csv = mk_rec_csv(list(prc_csvs.keys()), dates, n_recs, seed=seed)
+
+    def _step2():
+        bufs = {tic: io.StringIO(csv) for tic, csv in prc_csvs.items()}
+        return es.step2_panel(bufs, io.StringIO(mkt_csv))
+
+    def _step3():
+        return es.step3_panel(io.StringIO(rec_csv))
+
+    def _step4():
+        return es.step4_panel(ret_df, event_df.copy())
+
+    def _step5():
+        return es.step5(cars_df)
+
+    scale = {'n_tickers': n_tickers, 'n_years': n_years, 'n_recs': n_recs}
+    res = []
+    for step, func in [('step2', _step2), ('step3', _step3),
+            ('step4', _step4), ('step5', _step5)]:
+        out, seconds, peak_mb = measure(func)
+        if step == 'step2':
+            ret_df = out
+        elif step == 'step3':
+            event_df = out
+        elif step == 'step4':
+            cars_df = out
+        res.append(dict(scale, step=step, seconds=round(seconds, 6),
+            peak_mb=round(peak_mb, 3), rows_out=len(out)))
+    return res
+
+
+def run(scales=SCALES, pth='week10_bench.json', seed=0, verbose=True):
+    """ Benchmarks steps 2 to 5 for each scale (n_tickers, n_years, n_recs)
+    in `scales` and saves the results to the JSON file `pth`. Returns the
+    results as a data frame
+    """
+    results = []
+    for n_tickers, n_years, n_recs in scales:
+        rows = bench_scale(n_tickers, n_years, n_recs, seed=seed)
+        results.extend(rows)
+        if verbose is True:
+            for row in rows:
+                print(row)
+
+    report = {
+        'created': dt.datetime.now().isoformat(timespec='seconds'),
+        'results': results,
+        }
+    with open(pth, mode='wt') as fobj:
+        json.dump(report, fobj, indent=1)
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    run()
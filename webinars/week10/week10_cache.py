@@ -0,0 +1,248 @@
+""" week10_cache.py
+
+Persistent cache of CARs for the event study in `week10_slides_main`
+
+    toolkit/
+    |   ...
+    |__ webinars/
+    |   |__ week10/
+    |   |   |__ __init__.py
+    |   |   |__ week10_slides_main.py
+    |   |   |__ week10_cache.py           <- This module
+    |   |__ lec_utils.py            <- Required
+
+The CAR of an event only depends on its ticker, its event date, the event
+window, the model for abnormal returns and the returns of the ticker. The
+cache stores one file per ticker in `cache_dir`, with the CARs already
+computed for this ticker:
+
+    | event_date | lo | hi | model         | fingerprint | car    |
+    |------------+----+----+---------------+-------------+--------|
+    | 2020-09-23 | -2 | 2  | market_adj... | 5f1c...     | -0.067 |
+    | ...        | .. | .. | ...           | ...         | ...    |
+
+where (lo, hi) is the event window, `model` identifies the model for
+abnormal returns (see `model_key`) and `fingerprint` identifies the returns
+used to compute the CAR (see `ret_fingerprints`). When the returns of a
+ticker change, all the CARs of this ticker are evicted. CARs of other
+tickers are not affected.
+
+The CARs missing from the cache are computed with a single call to
+`calc_cars` for all the tickers, and only split by ticker to update the
+cache files.
+
+"""
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# Key used for the returns of `step2` (single stock, no ticker)
+SINGLE = '_single'
+
+CACHE_COLS = ['event_date', 'lo', 'hi', 'model', 'fingerprint', 'car']
+
+
+def ret_fingerprints(ret_df):
+    """ Returns a dictionary {<tic> : <fingerprint>} where each fingerprint
+    is a hash of the dates, stock returns and market returns of the ticker.
+
+    If `ret_df` is the output of `step2` (not a panel), the dictionary has a
+    single key, `SINGLE`.
+    """
+    if isinstance(ret_df.index, pd.MultiIndex):
+        groups = ret_df.groupby(level='ticker', sort=False)
+    else:
+        groups = [(SINGLE, ret_df)]
+
+    res = {}
+    for tic, df in groups:
+        dates = df.index.get_level_values(-1)
+        sha = hashlib.sha1()
+        sha.update(dates.to_numpy().astype('datetime64[ns]').tobytes())
+        for col in ['ret', 'mkt']:
+            values = df.loc[:, col].to_numpy(dtype=np.float64)
+            sha.update(np.ascontiguousarray(values).tobytes())
+        res[tic] = sha.hexdigest()
+    return res
+
+
+def model_key(model='market_adj', est_window=(-250, -30), min_est_obs=30,
+        non_trading='next', method='car'):
+    """ Returns a string identifying the model used to compute abnormal
+    returns, the treatment of events on non-trading days and how abnormal
+    returns are aggregated (CAR or BHAR)
+    """
+    if model == 'market':
+        model = f'market{tuple(est_window)}min{min_est_obs}'
+    key = f'{model}|{non_trading}'
+    if method != 'car':
+        # Keys of CARs cached before BHARs existed remain valid
+        key = f'{key}|{method}'
+    return key
+
+
+def _cache_pth(cache_dir, tic):
+    """ Location of the cache file for ticker `tic` """
+    return os.path.join(cache_dir, f'{tic}.pkl')
+
+
+def load_cache(cache_dir, tic, fingerprint=None):
+    """ Returns a data frame with the CARs stored for ticker `tic`. If
+    `fingerprint` is not None, CARs computed from other returns are
+    discarded.
+    """
+    pth = _cache_pth(cache_dir, tic)
+    if not os.path.exists(pth):
+        return pd.DataFrame({col: [] for col in CACHE_COLS})
+    df = pd.read_pickle(pth)
+    if fingerprint is not None:
+        df = df.loc[df.loc[:, 'fingerprint'] == fingerprint]
+    return df
+
+
+def save_cache(cache_dir, tic, df):
+    """ Saves the data frame `df` with the CARs for ticker `tic`, replacing
+    any existing cache file
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    pth = _cache_pth(cache_dir, tic)
+    tmp = f'{pth}.tmp'
+    df.loc[:, CACHE_COLS].reset_index(drop=True).to_pickle(tmp)
+    os.replace(tmp, pth)
+
+
+def evict(cache_dir, tic=None):
+    """ Removes the cached CARs for ticker `tic`, or for all tickers if `tic`
+    is None
+    """
+    if not os.path.isdir(cache_dir):
+        return
+    if tic is not None:
+        names = [f'{tic}.pkl']
+    else:
+        names = [x for x in os.listdir(cache_dir) if x.endswith('.pkl')]
+    for name in names:
+        pth = os.path.join(cache_dir, name)
+        if os.path.exists(pth):
+            os.remove(pth)
+
+
+def _update_cache(cache_dir, tic, fp, mkey, cache, dates, cars, windows):
+    """ Adds the CARs `cars` (dates x windows) of ticker `tic` to its cache
+    file, replacing the CARs cached for the same dates, windows and model.
+    NaN CARs are stored as well
+    """
+    n, k = len(dates), len(windows)
+    new_rows = pd.DataFrame({
+        'event_date': np.repeat(dates, k),
+        'lo': np.tile([lo for lo, hi in windows], n),
+        'hi': np.tile([hi for lo, hi in windows], n),
+        'model': mkey,
+        'fingerprint': fp,
+        'car': cars.ravel()})
+    if len(cache) > 0:
+        keys = ['event_date', 'lo', 'hi']
+        is_model = (cache.loc[:, 'model'] == mkey).to_numpy()
+        replaced = is_model & cache.set_index(keys).index.isin(
+                new_rows.set_index(keys).index)
+        kept = cache.loc[~replaced]
+        if len(kept) > 0:
+            new_rows = pd.concat([kept, new_rows])
+    save_cache(cache_dir, tic, new_rows)
+
+
+def cached_cars(calc_cars, event_df, ret_df, cache_dir,
+        windows=((-2, 2),), **kargs):
+    """ Same as `calc_cars(event_df, ret_df, windows, **kargs)`, but only
+    computes the CARs not found in the cache
+
+    Parameters
+    ----------
+    calc_cars : function
+        The function computing CARs, i.e., `week10_slides_main.calc_cars`
+
+    event_df : data frame
+        A data frame with the events of interest
+
+    ret_df : data frame
+        A data frame with stock and market returns (output of `step2` or
+        `step2_panel`)
+
+    cache_dir : str
+        Location of the folder with the cache files
+
+    windows : list, optional
+        List of event windows. See `week10_slides_main.calc_cars`
+
+    kargs
+        Other parameters passed to `calc_cars` (model, est_window,
+        min_est_obs, non_trading, method)
+
+    Returns
+    -------
+    array
+        An array (events x windows) with the CAR of each event (in the same
+        order as `event_df`) and window
+
+    """
+    windows = [tuple(window) for window in windows]
+    fps = ret_fingerprints(ret_df)
+    mkey = model_key(**kargs)
+    n_win = len(windows)
+    los = np.array([lo for lo, hi in windows])
+    his = np.array([hi for lo, hi in windows])
+
+    event_dates = pd.to_datetime(event_df.loc[:, 'event_date']).to_numpy()
+    event_dates = event_dates.astype('datetime64[ns]')
+    if isinstance(ret_df.index, pd.MultiIndex):
+        tickers = event_df.loc[:, 'ticker'].to_numpy()
+    else:
+        tickers = np.full(len(event_df), SINGLE, dtype=object)
+
+    # CARs are looked up and computed once per (ticker, date)
+    pairs = pd.MultiIndex.from_arrays([tickers, event_dates])
+    codes, pairs = pairs.factorize()
+    pair_tics = pairs.get_level_values(0).to_numpy()
+    pair_dates = pairs.get_level_values(1)
+    n_pairs = len(pairs)
+    # Tickers without returns: nothing to compute or cache
+    has_ret = pd.Index(pair_tics).isin(list(fps.keys()))
+
+    # Cached CARs of all the tickers, in a single series
+    caches = {tic: load_cache(cache_dir, tic, fingerprint=fps[tic])
+            for tic in pd.unique(pair_tics[has_ret])}
+    cached = [df.assign(ticker=tic) for tic, df in caches.items()
+            if len(df) > 0]
+    if len(cached) > 0:
+        cached = pd.concat(cached)
+        cached = cached.loc[cached.loc[:, 'model'] == mkey]
+        cached = cached.set_index(['ticker', 'event_date', 'lo', 'hi'])
+        cached = cached.loc[~cached.index.duplicated(keep='last'), 'car']
+        keys = pd.MultiIndex.from_arrays([
+            np.repeat(pair_tics, n_win), np.repeat(pair_dates, n_win),
+            np.tile(los, n_pairs), np.tile(his, n_pairs)])
+        pos = cached.index.get_indexer(keys).reshape(n_pairs, n_win)
+    else:
+        cached = pd.Series([], dtype=np.float64)
+        pos = np.full((n_pairs, n_win), -1)
+    # Position -1 (not found) points to the NaN appended at the end
+    cars = np.append(cached.to_numpy(dtype=np.float64), np.nan)[pos]
+
+    # Compute the CARs of all the pairs with a missing window at once
+    todo = np.flatnonzero(has_ret & (pos < 0).any(axis=1))
+    if len(todo) > 0:
+        new_events = pd.DataFrame({'event_date': pair_dates[todo],
+            'ticker': pair_tics[todo]})
+        new_cars = calc_cars(new_events, ret_df, windows=windows, **kargs)
+        cars[todo] = new_cars.to_numpy()
+
+        # Update the cache file of each ticker with new CARs
+        groups = pd.Series(todo).groupby(pair_tics[todo], sort=False)
+        for tic, rows in groups:
+            rows = rows.to_numpy()
+            _update_cache(cache_dir, tic, fps[tic], mkey, caches[tic],
+                    pair_dates[rows], cars[rows], windows)
+    return cars[codes]
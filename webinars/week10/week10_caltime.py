@@ -0,0 +1,238 @@
+""" week10_caltime.py
+
+Calendar-time portfolios for the panel event study in `week10_slides_main`
+
+    toolkit/
+    |   ...
+    |__ webinars/
+    |   |__ week10/
+    |   |   |__ __init__.py
+    |   |   |__ week10_slides_main.py
+    |   |   |__ week10_caltime.py         <- This module
+    |   |__ lec_utils.py            <- Required
+
+When many events happen on the same days, their CARs are correlated and the
+t-stats in `step5` are overstated. The calendar-time approach instead forms,
+for each type of event, one portfolio per day with the stocks that have an
+event window open on that day, and regresses the portfolio returns on the
+market returns:
+
+    port[t] = alpha + beta * mkt[t] + e[t]
+
+The average abnormal return is `alpha`, and its t-stat accounts for the
+cross-correlation of events on the same days.
+
+Every step is vectorized over the dates x tickers matrix of returns (see
+`week10_slides_main.panel_to_matrix`):
+
+- Open windows are marked with a difference array: +1 on the first day of
+  each window and -1 after its last day, followed by a cumulative sum over
+  the date axis
+- Portfolio returns are weighted sums over the ticker axis
+- The regressions of all portfolios are computed at once from column sums
+
+Usage
+-----
+
+>> ret_df = week10_slides_main.step2_panel(prc_csvs, mkt_csv)
+>> event_df = week10_slides_main.step3_panel(rec_csv)
+>> res = calendar_time(ret_df, event_df, window=(0, 20))
+
+"""
+import numpy as np
+import pandas as pd
+
+from webinars.week10 import week10_slides_main as es
+
+
+def open_windows(event_df, dates, tickers, window=(0, 20),
+        non_trading='next'):
+    """ Returns a boolean array (dates x tickers) that is True if the ticker
+    has at least one event window open on that date
+
+    Parameters
+    ----------
+    event_df : data frame
+        Events with the columns `ticker` and `event_date`
+
+    dates : DatetimeIndex
+        Sorted dates (rows). An Exception is raised if the dates are not
+        sorted
+
+    tickers : Index
+        Tickers (columns). Events of other tickers are ignored
+
+    window : tuple, optional
+        First and last day of the window, in trading days (rows of `dates`)
+        relative to the event date. Default is (0, 20)
+
+    non_trading : str, optional
+        How to deal with events on non-trading days. See
+        `week10_slides_main.event_positions`
+
+    """
+    lo, hi = window
+    if lo > hi:
+        raise Exception(f'Invalid event window: {window}')
+    # Events are placed by binary search in `dates`
+    if not dates.is_monotonic_increasing:
+        raise Exception('`dates` must be sorted')
+    n = len(dates)
+    trading_cal = pd.Series(np.arange(n), index=dates)
+    pos = es.event_positions(event_df.loc[:, 'event_date'], trading_cal,
+            non_trading=non_trading)
+    col = tickers.get_indexer(event_df.loc[:, 'ticker'])
+    keep = (pos >= 0) & (col >= 0)
+    pos, col = pos[keep], col[keep]
+
+    start = np.clip(pos + lo, 0, n)
+    end = np.clip(pos + hi + 1, 0, n)
+    diff = np.zeros((n + 1, len(tickers)), dtype=np.int32)
+    np.add.at(diff, (start, col), 1)
+    np.add.at(diff, (end, col), -1)
+    return np.cumsum(diff[:n], axis=0) > 0
+
+
+def portfolio_returns(ret_df, event_df, window=(0, 20), weighting='ew',
+        mcap=None, by='event_type', non_trading='next'):
+    """ Daily returns of the calendar-time portfolios
+
+    Parameters
+    ----------
+    ret_df : data frame
+        A panel of returns (output of `step2_panel`)
+
+    event_df : data frame
+        A data frame with the events of interest (output of `step3_panel`)
+
+    window : tuple, optional
+        Days after (or before) each event during which the stock is in the
+        portfolio, see `open_windows`. Default is (0, 20)
+
+    weighting : str, optional
+        - "ew": equal-weighted portfolios (default)
+        - "vw": value-weighted portfolios, using the market value of each
+          stock on the previous date
+
+    mcap : data frame, optional
+        Market values (dates x tickers), required if `weighting` is "vw"
+
+    by : str, optional
+        Column of `event_df` defining the portfolios. Default is
+        "event_type" (one portfolio for upgrades, one for downgrades)
+
+    non_trading : str, optional
+        See `week10_slides_main.event_positions`
+
+    Returns
+    -------
+    tuple
+        A tuple (port_df, count_df, mkt) where
+
+        - port_df is a data frame (dates x portfolios) with the portfolio
+          returns, NaN on dates without stocks in the portfolio
+        - count_df is a data frame (dates x portfolios) with the number of
+          stocks in each portfolio
+        - mkt is a series with the market return of each date
+
+    """
+    ret_mat, mkt = es.panel_to_matrix(ret_df)
+    dates, tickers = ret_mat.index, ret_mat.columns
+    ret = ret_mat.to_numpy(dtype=np.float64)
+    has_ret = ~np.isnan(ret)
+    ret = np.where(has_ret, ret, 0.0)
+
+    if weighting == 'ew':
+        weight = has_ret.astype(np.float64)
+    elif weighting == 'vw':
+        if mcap is None:
+            raise Exception('Value-weighted portfolios require `mcap`')
+        # Use the market value on the previous date
+        weight = mcap.reindex(index=dates, columns=tickers).shift(1)
+        weight = weight.to_numpy(dtype=np.float64)
+        weight = np.where(has_ret & (weight > 0), weight, 0.0)
+    else:
+        raise Exception(f'Unknown value for `weighting`: {weighting}')
+
+    ports, counts = {}, {}
+    for group, events in event_df.groupby(by, sort=True, observed=True):
+        in_port = open_windows(events, dates, tickers, window=window,
+                non_trading=non_trading)
+        w = np.where(in_port, weight, 0.0)
+        total = w.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            port = (w * ret).sum(axis=1) / total
+        port[~(total > 0)] = np.nan
+        ports[group] = port
+        counts[group] = (in_port & has_ret).sum(axis=1)
+
+    port_df = pd.DataFrame(ports, index=dates)
+    count_df = pd.DataFrame(counts, index=dates)
+    return port_df, count_df, mkt
+
+
+def ct_regress(port_df, mkt):
+    """ Regress the returns of each portfolio in `port_df` on the market
+    returns `mkt`, by OLS, using the dates with a portfolio return
+
+    All the regressions are computed at once from column sums.
+
+    Returns
+    -------
+    data frame
+        A data frame with one row per portfolio and the columns `alpha`,
+        `tstat` (of alpha), `beta` and `n_days`
+
+    """
+    y = port_df.to_numpy(dtype=np.float64)
+    x = mkt.reindex(port_df.index).to_numpy(dtype=np.float64)[:, None]
+    valid = ~np.isnan(y) & ~np.isnan(x)
+    y = np.where(valid, y, 0.0)
+    x = np.where(valid, x, 0.0)
+
+    n = valid.sum(axis=0)
+    sx, sy = x.sum(axis=0), y.sum(axis=0)
+    sxx, sxy, syy = (x * x).sum(axis=0), (x * y).sum(axis=0), \
+            (y * y).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sxx_dm = sxx - sx ** 2 / n
+        beta = (sxy - sx * sy / n) / sxx_dm
+        alpha = (sy - beta * sx) / n
+        # Sum of squared residuals and standard error of alpha
+        ssr = syy - alpha * sy - beta * sxy
+        s2 = ssr / (n - 2)
+        se_alpha = np.sqrt(s2 * sxx / (n * sxx_dm))
+        tstat = alpha / se_alpha
+    invalid = (n < 3) | ~(sxx_dm > 0)
+    for values in (alpha, beta, tstat):
+        values[invalid] = np.nan
+    return pd.DataFrame({'alpha': alpha, 'tstat': tstat, 'beta': beta,
+        'n_days': n}, index=port_df.columns)
+
+
+def calendar_time(ret_df, event_df, window=(0, 20), weighting='ew',
+        mcap=None, by='event_type', non_trading='next'):
+    """ Calendar-time portfolio analysis: the alternative to `step5` when
+    events are clustered in time
+
+    Parameters
+    ----------
+    ret_df, event_df, window, weighting, mcap, by, non_trading
+        See `portfolio_returns`
+
+    Returns
+    -------
+    data frame
+        A data frame with one row per portfolio (e.g. event type) and the
+        columns `alpha` (average daily abnormal return), `tstat`, `beta`,
+        `n_days` (number of days with a portfolio return) and `avg_stocks`
+        (average number of stocks in the portfolio on these days)
+
+    """
+    port_df, count_df, mkt = portfolio_returns(ret_df, event_df,
+            window=window, weighting=weighting, mcap=mcap, by=by,
+            non_trading=non_trading)
+    res = ct_regress(port_df, mkt)
+    has_port = port_df.notna()
+    res.loc[:, 'avg_stocks'] = count_df.where(has_port).mean()
+    return res
@@ -0,0 +1,312 @@
+""" week10_io.py
+
+Functions to read the CSV files used by the event study in
+`week10_slides_main`
+
+    toolkit/
+    |   ...
+    |__ webinars/
+    |   |__ week10/
+    |   |   |__ __init__.py
+    |   |   |__ week10_slides_main.py
+    |   |   |__ week10_io.py              <- This module
+    |   |__ lec_utils.py            <- Required
+
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import glob
+import hashlib
+import io
+import os
+import threading
+
+import pandas as pd
+
+# Parquet sidecars require pyarrow. Without it, sidecars are pickle files
+try:
+    import pyarrow
+    import pyarrow.csv
+    CACHE_EXT = 'parquet'
+except ImportError:
+    pyarrow = None
+    CACHE_EXT = 'pkl'
+
+
+# ----------------------------------------------------------------------------
+#   Cached CSV files
+# ----------------------------------------------------------------------------
+def _hash(value):
+    """ Short hash of the representation of `value` """
+    return hashlib.sha1(repr(value).encode('utf-8')).hexdigest()[:16]
+
+
+def _source_key(pth):
+    """ Returns a string identifying the contents of the file `pth`, through
+    its location, size and modification time
+    """
+    stat = os.stat(pth)
+    return _hash((os.path.abspath(pth), stat.st_size, stat.st_mtime_ns))
+
+
+def _cache_key(pth, kargs):
+    """ Returns a string "<source key>-<parameters key>" identifying the
+    contents of the file `pth` (see `_source_key`) and the parameters
+    `kargs` used to read it
+    """
+    return f'{_source_key(pth)}-{_hash(sorted(kargs.items()))}'
+
+
+def sidecar_pth(pth, kargs, cache_dir=None):
+    """ Returns the location of the cache file for the CSV file `pth` read
+    with the parameters `kargs`. By default, the cache file is stored next
+    to `pth`, e.g. "tsla_prc.csv.<source key>-<parameters key>.parquet"
+    """
+    if cache_dir is None:
+        cache_dir = os.path.dirname(os.path.abspath(pth))
+    name = f'{os.path.basename(pth)}.{_cache_key(pth, kargs)}.{CACHE_EXT}'
+    return os.path.join(cache_dir, name)
+
+
+def _remove_stale(pth, cache_pth):
+    """ Removes the cache files of the CSV file `pth` created from previous
+    versions of the file. Cache files of the current version read with other
+    parameters are kept
+    """
+    prefix = os.path.join(os.path.dirname(cache_pth), os.path.basename(pth))
+    src_key = _source_key(pth)
+    for old in glob.glob(f'{glob.escape(prefix)}.*.{CACHE_EXT}'):
+        key = old[len(prefix) + 1:-len(CACHE_EXT) - 1]
+        if key.split('-')[0] != src_key:
+            os.remove(old)
+
+
+def read_csv_cached(pth, cache_dir=None, **kargs):
+    """ Same as `pd.read_csv(pth, **kargs)`, but the resulting data frame is
+    saved to a columnar cache file (Parquet if pyarrow is installed). Later
+    calls load the data frame from this file directly, without parsing the
+    CSV file again.
+
+    There is one cache file per set of parameters `kargs`. Cache files are
+    rebuilt whenever the location, size or modification time of `pth`
+    change, and the ones created from previous versions of `pth` are
+    removed.
+
+    Parameters
+    ----------
+    pth : str, buffer
+        Location of the CSV file. Buffers (e.g. io.StringIO) are read with
+        pd.read_csv and never cached
+
+    cache_dir : str, optional
+        Folder with the cache files. If None, cache files are stored in the
+        same folder as `pth`
+
+    kargs
+        Parameters passed to pd.read_csv
+
+    Returns
+    -------
+    data frame
+
+    """
+    if not isinstance(pth, (str, os.PathLike)):
+        return pd.read_csv(pth, **kargs)
+
+    pth = os.fspath(pth)
+    cache_pth = sidecar_pth(pth, kargs, cache_dir=cache_dir)
+    if os.path.exists(cache_pth):
+        if CACHE_EXT == 'parquet':
+            return pd.read_parquet(cache_pth)
+        return pd.read_pickle(cache_pth)
+
+    df = pd.read_csv(pth, **kargs)
+
+    # Remove stale cache files for this CSV file and save the new one
+    tmp = f'{cache_pth}.tmp'
+    try:
+        _remove_stale(pth, cache_pth)
+        os.makedirs(os.path.dirname(cache_pth), exist_ok=True)
+        if CACHE_EXT == 'parquet':
+            df.to_parquet(tmp)
+        else:
+            df.to_pickle(tmp)
+        os.replace(tmp, cache_pth)
+    except OSError:
+        # The cache is optional (e.g. the folder may be read-only)
+        pass
+    return df
+
+
+# ----------------------------------------------------------------------------
+#   Typed CSV files
+# ----------------------------------------------------------------------------
+def read_typed_csv(csv, cols, float32=False, date_format='%Y-%m-%d',
+        engine=None, cache=False):
+    """ Reads only the columns `date` and `cols` of a CSV file with daily
+    data (prices or market returns), with pinned data types
+
+    Compared to pd.read_csv with default parameters, this function:
+
+    - Reads only the columns needed
+    - Does not infer the data type of the columns in `cols`, which are read
+      as float64 (or float32)
+    - Parses dates with an explicit format (or with the pyarrow engine)
+      instead of guessing it
+    - Only sorts the data frame if the dates in the file are not sorted
+
+    With the default engine, most of the time is spent tokenizing the file,
+    which still happens for every column, so the gain is mostly in memory:
+    the data frame only holds `cols` (e.g. one float column instead of six
+    for a price file). For a 33-year daily price file, loading takes about
+    the same time as pd.read_csv. With engine="pyarrow", the file is parsed
+    by `pyarrow.csv` with the column types pinned, which is about 3-4 times
+    faster than pd.read_csv.
+
+    Parameters
+    ----------
+    csv : str, buffer
+        Parameter to the passed to pd.read_csv
+
+    cols : list
+        Columns to read, other than `date`. E.g. ['close']
+
+    float32 : bool, optional
+        If True, read the columns in `cols` as float32 (half the memory of
+        float64). Default is False
+
+    date_format : str, optional
+        Format of the dates in the file. Default is '%Y-%m-%d'
+
+    engine : str, optional
+        Parser engine passed to pd.read_csv. If None, use the default engine.
+        If "pyarrow" (requires the pyarrow package), the file is read with
+        `pyarrow.csv` instead, unless `cache` is True. The pyarrow engine
+        parses ISO dates natively and ignores `date_format`
+
+    cache : bool, optional
+        If True, use a columnar cache file (see `read_csv_cached`)
+
+    Returns
+    -------
+    data frame
+        A data frame with the columns in `cols`. The index is a sorted
+        DatetimeIndex called `date`, without duplicated dates (the last row
+        of each date is kept)
+
+    """
+    dtype = 'float32' if float32 is True else 'float64'
+    if engine == 'pyarrow' and cache is not True:
+        return _sort_dates(_read_arrow(csv, cols, dtype))
+
+    kargs = dict(
+        usecols=['date'] + list(cols),
+        dtype={col: dtype for col in cols},
+        index_col='date',
+        parse_dates=['date'],
+        date_format=date_format,
+        )
+    if engine is not None:
+        kargs['engine'] = engine
+    if engine == 'pyarrow':
+        # The pyarrow engine does not support these options
+        del kargs['index_col'], kargs['date_format']
+    read_csv = read_csv_cached if cache is True else pd.read_csv
+    df = read_csv(csv, **kargs)
+    if engine == 'pyarrow':
+        df = df.set_index('date')
+    return _sort_dates(df)
+
+
+def _read_arrow(csv, cols, dtype):
+    """ Reads the columns `date` and `cols` of the CSV file `csv` with
+    `pyarrow.csv`. Returns a data frame indexed by date (see
+    `read_typed_csv`)
+    """
+    if pyarrow is None:
+        raise Exception('The pyarrow engine requires the pyarrow package')
+    if hasattr(csv, 'read'):
+        data = csv.read()
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        csv = io.BytesIO(data)
+    types = {col: pyarrow.from_numpy_dtype(dtype) for col in cols}
+    types['date'] = pyarrow.timestamp('ns')
+    opts = pyarrow.csv.ConvertOptions(include_columns=['date'] + list(cols),
+            column_types=types)
+    df = pyarrow.csv.read_csv(csv, convert_options=opts).to_pandas()
+    return df.set_index('date')
+
+
+def _sort_dates(df):
+    """ Sorts the data frame `df` by date and removes duplicated dates
+    (keeping the last row), unless already sorted and unique
+    """
+    # Files downloaded from Yahoo Finance are usually sorted already
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index(kind='stable')
+    if not df.index.is_unique:
+        df = df.loc[~df.index.duplicated(keep='last')]
+    return df
+
+
+# ----------------------------------------------------------------------------
+#   Many CSV files
+# ----------------------------------------------------------------------------
+def read_many(csvs, func, max_workers=None, max_open=None, progress=None):
+    """ Applies `func` to every file in `csvs` using a pool of threads.
+
+    Reading a CSV file with the C or pyarrow engines releases the GIL while
+    parsing, so several files can be parsed at the same time.
+
+    Parameters
+    ----------
+    csvs : dict
+        A dictionary {<key> : <csv>}, where each <csv> is a location or a
+        buffer
+
+    func : function
+        Function called as `func(<csv>)`, e.g. a function reading the CSV
+        file and computing returns
+
+    max_workers : int, optional
+        Number of threads. If None or 1, files are read sequentially
+
+    max_open : int, optional
+        Maximum number of files being read at the same time. If None, the
+        limit is the number of threads
+
+    progress : function, optional
+        Function called as `progress(<done>, <total>, <key>)` after each file
+        is read, from the calling thread
+
+    Returns
+    -------
+    dict
+        A dictionary {<key> : <output of func>}, in the same order as `csvs`
+
+    """
+    total = len(csvs)
+    if max_workers is None or max_workers <= 1:
+        res = {}
+        for done, (key, csv) in enumerate(csvs.items(), start=1):
+            res[key] = func(csv)
+            if progress is not None:
+                progress(done, total, key)
+        return res
+
+    slots = threading.BoundedSemaphore(max_open or max_workers)
+
+    def _read(csv):
+        with slots:
+            return func(csv)
+
+    res = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_read, csv): key
+                for key, csv in csvs.items()}
+        for done, future in enumerate(as_completed(futures), start=1):
+            key = futures[future]
+            res[key] = future.result()
+            if progress is not None:
+                progress(done, total, key)
+    return {key: res[key] for key in csvs}
@@ -0,0 +1,229 @@
+""" week10_parallel.py
+
+Parallel runner for the event study in `week10_slides_main`
+
+The events are split into partitions (by ticker or by event date) and the
+CARs of each partition are computed by a pool of worker processes. The
+returns are published once as a dates x tickers matrix in shared memory, so
+workers attach to it without copying or unpickling the return panel.
+Workers compute the CARs directly from the columns of the matrix: the
+trading calendar of each ticker is the rows of its column with a return.
+
+    toolkit/
+    |   ...
+    |__ webinars/
+    |   |__ week10/
+    |   |   |__ __init__.py
+    |   |   |__ week10_slides_main.py
+    |   |   |__ week10_parallel.py        <- This module
+    |   |__ lec_utils.py            <- Required
+
+Usage
+-----
+
+>> ret_df = week10_slides_main.step2_panel(prc_csvs, mkt_csv)
+>> event_df = week10_slides_main.step3_panel(rec_csv)
+>> cars_df = run_parallel(ret_df, event_df, windows=[(-1, 1), (-2, 2)])
+
+"""
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
+
+import numpy as np
+import pandas as pd
+
+from webinars.week10 import week10_slides_main as es
+
+
+# Shared return matrix, as seen by each worker process. The first column
+# holds the market returns and the remaining columns the stock returns
+_shm = None
+_mat = None
+_dates = None
+_days = None
+_tickers = None
+
+
+def _attach(shm_name, shape, dates, tickers):
+    """ Worker initializer: attach to the shared return matrix """
+    global _shm, _mat, _dates, _days, _tickers
+    _shm = shared_memory.SharedMemory(name=shm_name)
+    _mat = np.ndarray(shape, dtype=np.float64, buffer=_shm.buf)
+    _dates = dates
+    _days = dates.to_numpy().astype('datetime64[D]').astype(np.int64)
+    _tickers = pd.Index(tickers)
+
+
+def _run_part(event_part, kargs):
+    """ Worker task: compute the CARs for the events in `event_part` using
+    the returns of their tickers in the shared return matrix
+    """
+    kargs = dict(kargs)
+    windows = kargs.pop('windows', ((-2, 2),))
+    non_trading = kargs.pop('non_trading', 'next')
+    cols = _tickers.get_indexer(event_part.loc[:, 'ticker'])
+    tic_cols = np.unique(cols[cols >= 0])
+
+    # Trading calendar of each ticker: the rows with a stock and a market
+    # return, stored ticker by ticker as in a panel of returns
+    ret = _mat[:, tic_cols + 1].T
+    valid = ~np.isnan(ret) & ~np.isnan(_mat[:, 0])
+    blocks, rows = np.nonzero(valid)
+    if len(rows) == 0:
+        # None of these events can be placed
+        method = kargs.get('method', 'car')
+        cols = [es.car_col(window, method=method) for window in windows]
+        return pd.DataFrame(np.nan, index=event_part.index, columns=cols)
+    ret_df = pd.DataFrame({'ret': ret[valid], 'mkt': _mat[rows, 0]})
+    ends = np.cumsum(valid.sum(axis=1))
+    firsts = ends - valid.sum(axis=1)
+
+    # Block of the ticker of each event, empty if not in the matrix
+    blk = np.searchsorted(tic_cols, cols)
+    has_tic = cols >= 0
+    first = np.where(has_tic, firsts[np.minimum(blk, len(tic_cols) - 1)], 0)
+    last = np.where(has_tic, ends[np.minimum(blk, len(tic_cols) - 1)], 0)
+
+    event_days = pd.to_datetime(event_part.loc[:, 'event_date']).to_numpy()
+    event_days = event_days.astype('datetime64[D]').astype(np.int64)
+    pos = es._positions(_days[rows], blocks, first, last, event_days,
+            non_trading=non_trading)
+    cars = es._block_cars(ret_df, pos, (first, last), windows=windows,
+            **kargs)
+    return pd.DataFrame(cars, index=event_part.index)
+
+
+def partition_events(event_df, n_parts, by='ticker'):
+    """ Split the events in `event_df` into at most `n_parts` partitions
+
+    Parameters
+    ----------
+    event_df : data frame
+        A data frame with the events of interest (output of `step3_panel`)
+
+    n_parts : int
+        Maximum number of partitions
+
+    by : str, optional
+        - "ticker": all the events of a ticker are in the same partition.
+          Tickers are assigned to partitions so that partitions have a
+          similar number of events (default)
+        - "date": each partition contains the events in a range of event
+          dates
+
+    Returns
+    -------
+    list
+        A list of data frames, each a subset of the rows of `event_df`
+
+    """
+    if by == 'ticker':
+        counts = event_df.loc[:, 'ticker'].value_counts()
+        # Assign the largest tickers first, each to the smallest partition
+        sizes = np.zeros(n_parts, dtype=np.int64)
+        part_of = {}
+        for tic, count in counts.items():
+            i = int(sizes.argmin())
+            part_of[tic] = i
+            sizes[i] += count
+        labels = event_df.loc[:, 'ticker'].map(part_of).to_numpy()
+    elif by == 'date':
+        dates = pd.to_datetime(event_df.loc[:, 'event_date']).to_numpy()
+        order = np.argsort(dates, kind='stable')
+        labels = np.empty(len(dates), dtype=np.int64)
+        for i, chunk in enumerate(np.array_split(order, n_parts)):
+            labels[chunk] = i
+    else:
+        raise Exception(f'Unknown value for `by`: {by}')
+    parts = [event_df.loc[labels == i] for i in range(n_parts)]
+    return [part for part in parts if len(part) > 0]
+
+
+def run_parallel(ret_df, event_df, windows=None, model='market_adj',
+        est_window=(-250, -30), non_trading='next', max_workers=None,
+        by='ticker', n_parts=None, method='car'):
+    """ Calculate CARs for each event in `event_df` using a pool of worker
+    processes. This is the parallel version of `step4_panel`.
+
+    Parameters
+    ----------
+    ret_df : data frame
+        A panel of returns (output of `step2_panel`)
+
+    event_df : data frame
+        A data frame with the events of interest (output of `step3_panel`)
+
+    windows, model, est_window, non_trading, method
+        See `week10_slides_main.step4`
+
+    max_workers : int, optional
+        Number of worker processes. If None, use the number of CPUs
+
+    by : str, optional
+        How to partition the events: "ticker" (default) or "date". See
+        `partition_events`
+
+    n_parts : int, optional
+        Number of partitions. If None, use four partitions per worker
+
+    Returns
+    -------
+    data frame
+        A data frame with the same format as `event_df` but with additional
+        column(s) containing the CARs (see `week10_slides_main.step4`). Rows
+        are sorted by event_id.
+
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if n_parts is None:
+        n_parts = 4 * max_workers
+    # Workers only see the shared matrix, so the type of returns must be
+    # passed explicitly
+    kargs = dict(model=model, est_window=est_window, non_trading=non_trading,
+            method=method, ret_type=ret_df.attrs.get('ret_type', 'simple'))
+    if windows is not None:
+        kargs['windows'] = windows
+
+    # Publish the dates x (1 + tickers) matrix of returns once
+    ret_mat, mkt = es.panel_to_matrix(ret_df)
+    # Workers search the event dates in the rows of the matrix
+    if not ret_mat.index.is_monotonic_increasing:
+        raise Exception('The dates of the return matrix must be sorted')
+    values = np.column_stack([mkt.to_numpy(), ret_mat.to_numpy()])
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+    try:
+        mat = np.ndarray(values.shape, dtype=np.float64, buffer=shm.buf)
+        mat[:] = values
+        del values
+        init_args = (shm.name, mat.shape, ret_mat.index,
+                list(ret_mat.columns))
+
+        parts = partition_events(event_df, n_parts, by=by)
+        with ProcessPoolExecutor(max_workers=max_workers,
+                initializer=_attach, initargs=init_args) as executor:
+            futures = [executor.submit(_run_part, part, kargs)
+                    for part in parts]
+            cars = [future.result() for future in futures]
+    finally:
+        # The buffer cannot be released while `mat` still points to it
+        mat = None
+        shm.close()
+        shm.unlink()
+
+    # Merge the partial results in event_id order
+    df = event_df.sort_index()
+    if len(cars) == 0:
+        # No events
+        cols = [es.car_col(window, method=method)
+                for window in (windows or ((-2, 2),))]
+        cars = [pd.DataFrame(np.nan, index=df.index, columns=cols)]
+    cars = pd.concat(cars).sort_index()
+    if windows is None:
+        df.loc[:, method] = cars.iloc[:, 0]
+    else:
+        for col in cars.columns:
+            df.loc[:, col] = cars.loc[:, col]
+    return df
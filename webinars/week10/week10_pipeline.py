@@ -0,0 +1,282 @@
+""" week10_pipeline.py
+
+Lazy, memoized version of the event study in `week10_slides_main`
+
+    toolkit/
+    |   ...
+    |__ webinars/
+    |   |__ week10/
+    |   |   |__ __init__.py
+    |   |   |__ week10_slides_main.py
+    |   |   |__ week10_pipeline.py        <- This module
+    |   |__ lec_utils.py            <- Required
+    |__ toolkit_config.py           <- Required
+
+The pipeline is a graph of stages. Each stage is a dictionary created by
+`stage`, with the function to call, the names of the stages whose outputs
+are passed to it (positional arguments) and its other parameters (keyword
+arguments):
+
+    graph = {
+        'ret_df': stage(es.step2, prc_csv=..., mkt_csv=...),
+        'event_df': stage(es.step3, rec_csv=...),
+        'cars_df': stage(es.step4, 'ret_df', 'event_df', windows=...),
+        'res': stage(es.step5, 'cars_df'),
+        }
+
+Each stage has a key, a hash of its function (name and source code of the
+module defining it, so that changes to the helpers it calls are detected),
+its parameters and the keys of the stages it depends on. Files passed as
+parameters are hashed by location, size and modification time, buffers,
+data frames and indexes by their contents, and functions by name. The
+output of each stage is saved to `<artifact_dir>/<stage>.<key>.pkl`.
+
+`run(graph, 'res')` only computes the stages needed for `res` whose key has
+no artifact yet. Keys are computed without loading any data, so if only the
+parameters of step 5 change, step 5 is computed from the saved output of
+step 4, and steps 2 to 4 are not even loaded.
+
+Usage
+-----
+
+>> graph = mk_graph(prc_csv, mkt_csv, rec_csv, windows=[(-1, 1)])
+>> res = run(graph, 'res')
+
+"""
+import hashlib
+import inspect
+import io
+import os
+
+import pandas as pd
+
+import toolkit_config as cfg
+from webinars.week10 import week10_slides_main as es
+
+
+ARTIFACT_DIR = os.path.join(cfg.DATADIR, 'week10_artifacts')
+
+
+# ----------------------------------------------------------------------------
+#   Graph
+# ----------------------------------------------------------------------------
+def stage(func, *deps, **params):
+    """ Returns a stage calling `func(<output of deps>..., **params)` """
+    return {'func': func, 'deps': list(deps), 'params': params}
+
+
+def mk_graph(prc_csv, mkt_csv, rec_csv, panel=False, step2_kargs=None,
+        step3_kargs=None, step4_kargs=None, step5_kargs=None):
+    """ Returns the graph of the event study (steps 2 to 5)
+
+    Parameters
+    ----------
+    prc_csv : str, buffer, dict
+        Price file(s). A dictionary {<tic> : <prc_csv>} if `panel` is True
+        (see `week10_slides_main.step2_panel`)
+
+    mkt_csv, rec_csv : str, buffer
+        Market returns and recommendations
+
+    panel : bool, optional
+        If True, use the panel version of steps 2 to 4
+
+    step2_kargs, step3_kargs, step4_kargs, step5_kargs : dict, optional
+        Other parameters of each step, e.g. {'windows': [(-1, 1)]} for step 4
+
+    Returns
+    -------
+    dict
+        The graph, with the stages `ret_df`, `event_df`, `cars_df` and `res`
+
+    """
+    step2, step3, step4 = es.step2, es.step3, es.step4
+    if panel is True:
+        step2, step3, step4 = es.step2_panel, es.step3_panel, es.step4_panel
+        prc_key = 'prc_csvs'
+    else:
+        prc_key = 'prc_csv'
+    step2_kargs = dict(step2_kargs or {}, **{prc_key: prc_csv,
+        'mkt_csv': mkt_csv})
+    step3_kargs = dict(step3_kargs or {}, rec_csv=rec_csv)
+    return {
+        'ret_df': stage(step2, **step2_kargs),
+        'event_df': stage(step3, **step3_kargs),
+        'cars_df': stage(step4, 'ret_df', 'event_df', **(step4_kargs or {})),
+        'res': stage(es.step5, 'cars_df', **(step5_kargs or {})),
+        }
+
+
+# ----------------------------------------------------------------------------
+#   Keys
+# ----------------------------------------------------------------------------
+def _func_name(func):
+    """ Returns the full name of the function `func`, e.g.
+    "webinars.week10.week10_slides_main.step4"
+    """
+    name = getattr(func, '__qualname__', None)
+    # Lambdas and nested functions have no unique name
+    if name is None or '<' in name:
+        raise Exception(f'Cannot identify the function {func!r}')
+    return f'{getattr(func, "__module__", None)}.{name}'
+
+
+def _func_key(func):
+    """ Returns a string identifying the function `func` and its code. The
+    code is the source of the whole module defining `func`, so changes to
+    the functions it calls in the same module are detected as well
+    """
+    try:
+        src = inspect.getsource(inspect.getmodule(func))
+    except (OSError, TypeError):
+        src = ''
+    sha = hashlib.sha1(src.encode('utf-8')).hexdigest()
+    return f'{_func_name(func)}:{sha}'
+
+
+def _value_key(value):
+    """ Returns a string identifying a parameter value. Existing files are
+    identified by location, size and modification time, buffers, data
+    frames and indexes by their contents and functions by name
+    """
+    if isinstance(value, dict):
+        items = sorted((repr(k), _value_key(v)) for k, v in value.items())
+        return repr(items)
+    if isinstance(value, (list, tuple)):
+        return repr([_value_key(v) for v in value])
+    if isinstance(value, (str, os.PathLike)) and os.path.isfile(value):
+        stat = os.stat(value)
+        return repr(('file', os.path.abspath(value), stat.st_size,
+            stat.st_mtime_ns))
+    if isinstance(value, (io.StringIO, io.BytesIO)):
+        data = value.getvalue()
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        return repr(('buffer', hashlib.sha1(data).hexdigest()))
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        hashed = pd.util.hash_pandas_object(value, index=True)
+        return repr(('frame', hashlib.sha1(hashed.to_numpy()).hexdigest()))
+    if isinstance(value, pd.Index):
+        hashed = pd.util.hash_pandas_object(value)
+        return repr(('index', list(value.names),
+            hashlib.sha1(hashed.to_numpy()).hexdigest()))
+    if callable(value):
+        # The repr of a function includes its address, which changes
+        # between runs
+        return repr(('func', _func_name(value)))
+    return repr(value)
+
+
+def stage_keys(graph, target=None, keys=None):
+    """ Returns a dictionary {<stage> : <key>} with the keys of `target` and
+    the stages it depends on (all the stages if `target` is None)
+    """
+    if keys is None:
+        keys = {}
+    targets = list(graph.keys()) if target is None else [target]
+    for name in targets:
+        if name in keys:
+            continue
+        if name not in graph:
+            raise Exception(f'Unknown stage: {name}')
+        node = graph[name]
+        for dep in node['deps']:
+            stage_keys(graph, dep, keys)
+        parts = [_func_key(node['func'])]
+        parts.extend(f'{dep}={keys[dep]}' for dep in node['deps'])
+        parts.extend(f'{k}={_value_key(v)}'
+                for k, v in sorted(node['params'].items()))
+        key = '|'.join(parts).encode('utf-8')
+        keys[name] = hashlib.sha1(key).hexdigest()[:16]
+    return keys
+
+
+# ----------------------------------------------------------------------------
+#   Running the graph
+# ----------------------------------------------------------------------------
+def artifact_pth(name, key, artifact_dir=None):
+    """ Location of the saved output of stage `name` with key `key` """
+    if artifact_dir is None:
+        artifact_dir = ARTIFACT_DIR
+    return os.path.join(artifact_dir, f'{name}.{key}.pkl')
+
+
+def _rewind(value):
+    """ Moves buffers in `value` back to the start so they can be read """
+    if isinstance(value, io.IOBase) and value.seekable():
+        value.seek(0)
+    elif isinstance(value, dict):
+        for v in value.values():
+            _rewind(v)
+    return value
+
+
+def run(graph, target='res', artifact_dir=None, force=False, verbose=False):
+    """ Returns the output of the stage `target`, computing only the stages
+    without a saved output for their current key
+
+    Parameters
+    ----------
+    graph : dict
+        The pipeline (see `mk_graph`)
+
+    target : str, optional
+        The stage to compute. Default is "res" (step 5)
+
+    artifact_dir : str, optional
+        Folder with the saved outputs. Default is `ARTIFACT_DIR`
+
+    force : bool, optional
+        If True, recompute `target` and all the stages it depends on
+
+    verbose : bool, optional
+        If True, print whether each stage is loaded or computed
+
+    Returns
+    -------
+    The output of `target`
+
+    """
+    keys = stage_keys(graph, target)
+    outputs = {}
+
+    def _get(name):
+        if name in outputs:
+            return outputs[name]
+        pth = artifact_pth(name, keys[name], artifact_dir)
+        if force is False and os.path.exists(pth):
+            if verbose is True:
+                print(f'{name}: loaded {pth}')
+            out = pd.read_pickle(pth)
+        else:
+            node = graph[name]
+            args = [_get(dep) for dep in node['deps']]
+            params = {k: _rewind(v) for k, v in node['params'].items()}
+            if verbose is True:
+                print(f'{name}: computing')
+            out = node['func'](*args, **params)
+            os.makedirs(os.path.dirname(pth), exist_ok=True)
+            tmp = f'{pth}.tmp'
+            pd.to_pickle(out, tmp)
+            os.replace(tmp, pth)
+        outputs[name] = out
+        return out
+
+    return _get(target)
+
+
+def clear(artifact_dir=None, graph=None):
+    """ Removes saved outputs from `artifact_dir`. If `graph` is given,
+    outputs matching the current key of each stage are kept
+    """
+    if artifact_dir is None:
+        artifact_dir = ARTIFACT_DIR
+    if not os.path.isdir(artifact_dir):
+        return
+    keep = set()
+    if graph is not None:
+        keep = {os.path.basename(artifact_pth(name, key, artifact_dir))
+                for name, key in stage_keys(graph).items()}
+    for name in os.listdir(artifact_dir):
+        if name.endswith('.pkl') and name not in keep:
+            os.remove(os.path.join(artifact_dir, name))
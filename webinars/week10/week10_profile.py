@@ -0,0 +1,226 @@
+""" week10_profile.py
+
+Opt-in instrumentation of the steps of the event study in
+`week10_slides_main`
+
+    toolkit/
+    |   ...
+    |__ webinars/
+    |   |__ week10/
+    |   |   |__ __init__.py
+    |   |   |__ week10_slides_main.py
+    |   |   |__ week10_profile.py         <- This module
+    |   |__ lec_utils.py            <- Required
+
+The steps in `week10_slides_main` are decorated with `profiled`. While
+profiling is disabled (the default), the decorator only checks a global
+flag before calling the step. Once `enable(pth)` is called, each call to a
+step appends one line to the JSON-lines file `pth`, e.g.:
+
+    {"run_id": "20261018T100000-1234", "ts": "2026-10-18T10:00:01",
+     "step": "step4", "wall_s": 0.0123, "cpu_s": 0.0121, "rows_in": 5015,
+     "rows_out": 10, "rss_peak_delta_mb": 0.0, "df_mb": 0.001, "pid": 1234}
+
+where
+
+- rows_in: total number of rows of the data frames and series passed to
+  the step
+- rows_out: number of rows of the output (if a data frame or series)
+- rss_peak_delta_mb: increase in the peak resident set size of the process
+  during the step (None if the `resource` module is not available, e.g. on
+  Windows). A step that does not exceed the previous peak reports 0
+- df_mb: memory used by the output data frame
+
+Traces from several runs (e.g. nightly runs) can be appended to the same
+file and aggregated with `summarize`.
+
+Usage
+-----
+
+>> enable('week10_trace.jsonl')
+>> week10_slides_main.main()
+>> disable()
+>> summarize('week10_trace.jsonl')
+
+"""
+import contextlib
+import datetime as dt
+import functools
+import json
+import os
+import time
+
+import pandas as pd
+
+# The peak RSS is only available on Unix
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# Profiling state. `_pth` is None while profiling is disabled
+_pth = None
+_run_id = None
+_deep = False
+
+
+def enable(pth, run_id=None, deep=False):
+    """ Start recording the steps to the JSON-lines file `pth`
+
+    Parameters
+    ----------
+    pth : str
+        Location of the trace file. Records are appended to it
+
+    run_id : str, optional
+        Identifies the records of this run. Default is the current time and
+        the process id
+
+    deep : bool, optional
+        If True, measure the memory of object (e.g. string) columns as well,
+        which is slower (see `pd.DataFrame.memory_usage`). Default is False
+
+    """
+    global _pth, _run_id, _deep
+    if run_id is None:
+        now = dt.datetime.now().strftime('%Y%m%dT%H%M%S')
+        run_id = f'{now}-{os.getpid()}'
+    _pth, _run_id, _deep = pth, run_id, deep
+
+
+def disable():
+    """ Stop recording """
+    global _pth
+    _pth = None
+
+
+def is_enabled():
+    """ Returns True if the steps are being recorded """
+    return _pth is not None
+
+
+def _peak_rss_mb():
+    """ Peak resident set size of this process, in MB """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    unit = 1 if os.uname().sysname == 'Darwin' else 1024
+    return peak * unit / 2**20
+
+
+def _n_rows(obj):
+    """ Number of rows of `obj`, None if not a data frame or series """
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return len(obj)
+    return None
+
+
+def _mem_mb(obj):
+    """ Memory used by the data frame or series `obj`, in MB """
+    if isinstance(obj, pd.DataFrame):
+        return obj.memory_usage(index=True, deep=_deep).sum() / 2**20
+    if isinstance(obj, pd.Series):
+        return obj.memory_usage(index=True, deep=_deep) / 2**20
+    return None
+
+
+def _write(rec):
+    """ Appends the record `rec` to the trace file """
+    with open(_pth, mode='at') as fobj:
+        fobj.write(json.dumps(rec) + '\n')
+
+
+@contextlib.contextmanager
+def profile(step, rows_in=None):
+    """ Context manager recording the block as step `step`. Rows and memory
+    can be reported by setting the keys of the dictionary it returns:
+
+    >> with profile('load') as info:
+    >>     df = pd.read_csv(...)
+    >>     info['rows_out'] = len(df)
+
+    Nothing is recorded while profiling is disabled.
+    """
+    info = {'rows_in': rows_in, 'rows_out': None, 'df_mb': None}
+    if _pth is None:
+        yield info
+        return
+
+    rss = _peak_rss_mb()
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    error = None
+    try:
+        yield info
+    except BaseException as exc:
+        error = type(exc).__name__
+        raise
+    finally:
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        rss_end = _peak_rss_mb()
+        rec = {
+            'run_id': _run_id,
+            'ts': dt.datetime.now().isoformat(timespec='seconds'),
+            'step': step,
+            'wall_s': round(wall, 6),
+            'cpu_s': round(cpu, 6),
+            'rows_in': info['rows_in'],
+            'rows_out': info['rows_out'],
+            'rss_peak_delta_mb': None if rss is None
+                else round(rss_end - rss, 3),
+            'df_mb': None if info['df_mb'] is None
+                else round(info['df_mb'], 3),
+            'pid': os.getpid(),
+            }
+        if error is not None:
+            rec['error'] = error
+        _write(rec)
+
+
+def profiled(func=None, step=None):
+    """ Decorator recording every call to `func` (see `profile`). The step
+    is named after the function unless `step` is given. Rows in are counted
+    over the data frames and series passed to `func`; rows out and memory
+    are measured on its output
+    """
+    if func is None:
+        return functools.partial(profiled, step=step)
+    name = func.__name__ if step is None else step
+
+    @functools.wraps(func)
+    def wrapper(*args, **kargs):
+        if _pth is None:
+            return func(*args, **kargs)
+        rows = [_n_rows(x) for x in list(args) + list(kargs.values())]
+        rows = [x for x in rows if x is not None]
+        with profile(name, rows_in=sum(rows) if rows else None) as info:
+            res = func(*args, **kargs)
+            info['rows_out'] = _n_rows(res)
+            info['df_mb'] = _mem_mb(res)
+        return res
+    return wrapper
+
+
+def load_trace(pth):
+    """ Returns a data frame with the records in the trace file `pth` """
+    return pd.read_json(pth, lines=True)
+
+
+def summarize(pth):
+    """ Returns a data frame with the number of calls and the total wall
+    time, CPU time and rows of each step, for each run in the trace file
+    `pth`
+    """
+    df = load_trace(pth)
+    groups = df.groupby(['run_id', 'step'], sort=False)
+    return groups.agg(
+            calls=('step', 'size'),
+            wall_s=('wall_s', 'sum'),
+            cpu_s=('cpu_s', 'sum'),
+            rows_in=('rows_in', 'sum'),
+            rows_out=('rows_out', 'sum'),
+            rss_peak_delta_mb=('rss_peak_delta_mb', 'max'),
+            )
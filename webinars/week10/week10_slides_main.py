@@ -19,10 +19,15 @@ files
 """
 import datetime as dt
 
+import numpy as np
 import pandas as pd
 
 from webinars import lec_utils as utils
+from webinars.week10 import week10_cache as car_cache
+from webinars.week10 import week10_io
+from webinars.week10 import week10_profile as prof
 from webinars.week10 import week10_slides_data as data
+from webinars.week10 import week10_stats as stats
 
 utils.pp_cfg.sep = True
 utils.pp_cfg.df_info = True
@@ -31,7 +36,8 @@ utils.pp_cfg.df_info = True
 # ----------------------------------------------------------------------------
 #   Step 2; Calculating returns 
 # ----------------------------------------------------------------------------
-def step2(prc_csv, mkt_csv):
+@prof.profiled
+def step2(prc_csv, mkt_csv, cache=False, typed=None, ret_type='simple'):
     """ Given CSV files with stock prices and market returns, create a data
     frame with stock and market returns
 
@@ -56,11 +62,33 @@ def step2(prc_csv, mkt_csv):
         - date
         - mkt (column with market returns)
 
+    cache : bool, optional
+        If True, CSV files (but not buffers) are parsed only once: the data
+        frames are saved to columnar cache files next to the CSV files and
+        loaded from there until the CSV files change (see
+        `week10_io.read_csv_cached`). Default is False
+
+    typed : dict, optional
+        If not None, only the columns `date`, `close` and `mkt` are read,
+        with pinned data types and date format, using
+        `week10_io.read_typed_csv`. The dictionary holds the options passed
+        to this function, e.g. {'float32': True, 'engine': 'pyarrow'} (use
+        an empty dictionary for the default options). The pyarrow engine is
+        the fast option; the default engine mostly saves memory. Default is
+        None
+
+    ret_type : str, optional
+        The type of returns in the output:
+        - "simple": simple returns, p[t] / p[t-1] - 1 (default)
+        - "log": log returns, log(p[t] / p[t-1]). Market returns in `mkt_csv`
+          are simple returns and are converted to log(1 + mkt)
+
     Returns
     -------
     data frame:
         A data frame with stock returns (ret) and market returns (mkt). Index
-        is a DatetimeIndex
+        is a DatetimeIndex. The type of returns is stored in
+        `df.attrs['ret_type']`
 
 
 
@@ -110,35 +138,58 @@ def step2(prc_csv, mkt_csv):
 
     """
     #   2.1: Load prices and mkt ret to data frames 
-    df= pd.read_csv(prc_csv, index_col='date', parse_dates=['date'])
-    #utils.pprint(df, "df")
-
-    mkt_df = pd.read_csv(mkt_csv, index_col='date', parse_dates=['date'])
-    #utils.pprint(mkt_df, "mkt_df")
+    if typed is None:
+        read_csv = week10_io.read_csv_cached if cache is True else pd.read_csv
+        df= read_csv(prc_csv, index_col='date', parse_dates=['date'])
+        #utils.pprint(df, "df")
+
+        mkt_df = read_csv(mkt_csv, index_col='date', parse_dates=['date'])
+        #utils.pprint(mkt_df, "mkt_df")
+        df.sort_index(inplace=True)
+    else:
+        # Typed frames are already sorted by date
+        df = week10_io.read_typed_csv(prc_csv, cols=['close'], cache=cache,
+                **typed)
+        mkt_df = week10_io.read_typed_csv(mkt_csv, cols=['mkt'],
+                cache=cache, **typed)
 
     #   2.2: Compute returns
-    df.sort_index(inplace=True)
-
-    df.loc[:, 'ret'] = df.loc[:, 'close'].pct_change()
+    df.loc[:, 'ret'] = _calc_rets(df.loc[:, 'close'], ret_type)
+    if ret_type == 'log':
+        mkt_df = np.log1p(mkt_df.loc[:, ['mkt']])
 
     #   2.3: Join market returns
     df = df.join(mkt_df, how='inner')
 
 
     #   2.4: Keep only columns of interest
+    # NOTE: `.loc` creates a new data frame, so no copy is required
     cols = ['mkt', 'ret']
     df = df.loc[:, cols]
 
     # Get rid of any row with NaN
     df.dropna(inplace=True)
 
-    return df.copy()
+    df.attrs['ret_type'] = ret_type
+    return df
+
+
+def _calc_rets(prc, ret_type='simple'):
+    """ Returns a series with the returns ("simple" or "log") computed from
+    the series of prices `prc`
+    """
+    if ret_type == 'simple':
+        return prc.pct_change()
+    elif ret_type == 'log':
+        return np.log(prc).diff()
+    raise Exception(f'Unknown value for `ret_type`: {ret_type}')
 
 
 # ----------------------------------------------------------------------------
 #  Step 3: Select the events of interest
 # ----------------------------------------------------------------------------
-def step3(rec_csv):
+@prof.profiled
+def step3(rec_csv, categorical=False, align=None):
     """ Given a CSV file with the recommendations downloaded from Yahoo
     Finance, create a data frame with the events of interest.
 
@@ -163,6 +214,23 @@ def step3(rec_csv):
         - firm
         - action
 
+    categorical : bool, optional
+        If True, select the events without string operations on every row
+        (see `_select_events_cat`). The events selected are the same, but
+        `firm` and `event_type` are categorical columns and `event_date` is
+        a datetime64 column with normalized dates. Default is False
+
+    align : dict, optional
+        If not None, each recommendation is assigned to the trading session
+        in which it can first affect prices: recommendations issued after
+        the close move to the next session, and recommendations issued on
+        non-trading days to the following session (see `align_sessions`).
+        The dictionary holds the options passed to `align_sessions`, e.g.
+        {'sessions': ret_df.index, 'close_time': '16:00',
+        'tz': 'America/New_York'} (use an empty dictionary for the default
+        options). If None (default), the event date is the calendar date of
+        the recommendation
+
     Returns
     -------
     frame:
@@ -218,18 +286,152 @@ def step3(rec_csv):
     """
     # Step 3.1. Read the appropriate CSV file with recommendations into a DF
     usecols = ['date', 'firm', 'action']
+    dtype = {'firm': 'category', 'action': 'category'} if categorical \
+            else None
     df = pd.read_csv(rec_csv, 
             index_col='date', 
             parse_dates=['date'],
-            usecols=usecols)
+            usecols=usecols,
+            dtype=dtype)
     df.sort_index(inplace=True)
+    if align is not None:
+        df.index = align_sessions(df.index, **align)
+
+    # Steps 3.2 to 3.4
+    keys = ['event_date', 'firm']
+    cols = ['firm', 'event_date', 'event_type']
+    if categorical is True:
+        return _select_events_cat(df, keys=keys, cols=cols)
+    return _select_events(df, keys=keys, cols=cols)
+
+
+def align_sessions(stamps, sessions=None, close_time='16:00', tz=None,
+        rec_tz=None):
+    """ Returns the trading session of each timestamp in `stamps`: the same
+    day if the timestamp is before the close of a trading day, the next
+    trading day otherwise (after the close or on a non-trading day)
+
+    Parameters
+    ----------
+    stamps : DatetimeIndex
+        Sorted or unsorted timestamps (e.g. of recommendations)
+
+    sessions : array-like, optional
+        The trading days, e.g. the index of `ret_df` (or its `date` level).
+        If None, trading days are business days (Monday to Friday)
+
+    close_time : str, optional
+        Closing time of the exchange, e.g. "16:00" (default). Timestamps at
+        or after the close belong to the next session
+
+    tz : str, optional
+        Time zone of the exchange, e.g. "America/New_York". If None,
+        timestamps are taken as exchange (local) times
+
+    rec_tz : str, optional
+        Time zone of naive timestamps in `stamps`, if different from `tz`,
+        e.g. "UTC". Naive timestamps in a daylight saving time transition
+        are localized as follows: times skipped when clocks move forward
+        (e.g. 02:30 on the day DST starts) are shifted forward to the first
+        valid time, and repeated times when clocks move back are taken as
+        standard time (the second occurrence)
+
+    Returns
+    -------
+    DatetimeIndex
+        The (naive, normalized) session of each timestamp. Timestamps after
+        the last session in `sessions` are assigned to their calendar day
+        (or the next calendar day, if after the close)
+
+    """
+    stamps = pd.DatetimeIndex(stamps)
+    if tz is not None:
+        if stamps.tz is None:
+            stamps = stamps.tz_localize(rec_tz or tz,
+                    nonexistent='shift_forward',
+                    ambiguous=np.zeros(len(stamps), dtype=bool))
+        stamps = stamps.tz_convert(tz)
+    if stamps.tz is not None:
+        stamps = stamps.tz_localize(None)
+
+    days = stamps.normalize()
+    close = pd.Timestamp(f'1970-01-01 {close_time}') - pd.Timestamp(0)
+    after = np.asarray((stamps - days) >= close)
+
+    if sessions is None:
+        # Next business day, or the same day if before the close
+        day_d = days.to_numpy().astype('datetime64[D]')
+        res = np.where(after,
+                np.busday_offset(day_d, 1, roll='backward'),
+                np.busday_offset(day_d, 0, roll='forward'))
+        res = res.astype('datetime64[ns]')
+    else:
+        cal = pd.DatetimeIndex(sessions)
+        if cal.tz is not None:
+            cal = cal.tz_localize(None)
+        cal = np.unique(cal.normalize().to_numpy().astype('datetime64[ns]'))
+        day_ns = days.to_numpy().astype('datetime64[ns]')
+        pos = np.where(after,
+                np.searchsorted(cal, day_ns, side='right'),
+                np.searchsorted(cal, day_ns, side='left'))
+        beyond = pos >= len(cal)
+        res = cal[np.minimum(pos, max(len(cal) - 1, 0))] if len(cal) > 0 \
+                else day_ns.copy()
+        res[beyond] = day_ns[beyond] + after[beyond] * np.timedelta64(1, 'D')
+    return pd.DatetimeIndex(res, name=stamps.name)
+
+
+def _select_events(df, keys, cols, first_id=1):
+    """ Given a data frame with recommendations sorted by date (see
+    `step3`), select the events of interest
+
+    Parameters
+    ----------
+    df : data frame
+        A data frame with the columns `firm` and `action` (and any other
+        column in `keys`) indexed by the date of the recommendation
+
+    keys : list
+        Columns identifying a recommendation. Only the last recommendation
+        with the same values for these columns is kept. Must include
+        "event_date" and "firm"
+
+    cols : list
+        Columns of the data frame returned
+
+    first_id : int, optional
+        The ID of the first event. Default is 1
 
+    Returns
+    -------
+    frame
+        A data frame with the columns in `cols`. The index is called
+        event_id and starts at `first_id`
+
+    """
     # Step 3.2. Create variables identifying the firm and the event date
+    df = _prep_recs(df)
+
+    # Steps 3.3 and 3.4
+    return _last_events(df, keys, cols, first_id=first_id)
+
+
+def _prep_recs(df):
+    """ Step 3.2: Create variables identifying the firm (in upper case) and
+    the event date (formatted as 'YYYY-MM-DD') of each recommendation
+    """
     df.loc[:, 'firm'] = df.loc[:, 'firm'].str.upper()
     df.loc[:, 'event_date'] = df.index.strftime('%Y-%m-%d') 
+    return df
 
+
+def _last_events(df, keys, cols, first_id=1):
+    """ Steps 3.3 and 3.4: Given a data frame with recommendations created by
+    `_prep_recs`, keep the last recommendation for each group of `keys` and
+    create the table of events. See `_select_events`.
+    """
     # Step 3.3. Deal with multiple recommendations
-    groups = df.groupby(['event_date', 'firm'])
+    groups = df.groupby(keys)
     # Select the last obs for each group using the GroupBy method `last`
     df = groups.last().reset_index() 
 
@@ -255,16 +457,182 @@ def step3(rec_csv):
 
     # 3.4.3 Create the event id index:
     df.reset_index(inplace=True)
-    df.index = df.index + 1
+    df.index = df.index + first_id
     df.index.name = 'event_id'
 
     # 3.4.4: Reorganise the columns
-    cols = ['firm', 'event_date', 'event_type']
     df = df.loc[:, cols]
 
     return df.copy()
 
 
+def _map_categories(ser, func):
+    """ Given a categorical series `ser`, returns a categorical series with
+    the values func(<value>), e.g. func = str.upper. `func` is applied to
+    the categories only, not to every row. Categories mapped to the same
+    value are merged, and the new categories are sorted.
+    """
+    old_cats = ser.cat.categories
+    new_vals = pd.Index([func(x) for x in old_cats])
+    new_cats = new_vals.unique().sort_values()
+    # Code of each old category in the new categories (NaN stays -1)
+    lookup = np.append(new_cats.get_indexer(new_vals), -1)
+    codes = lookup[ser.cat.codes.to_numpy()]
+    return pd.Series(pd.Categorical.from_codes(codes, categories=new_cats),
+            index=ser.index, name=ser.name)
+
+
+def _select_events_cat(df, keys, cols, first_id=1):
+    """ Same as `_select_events`, but `df` has categorical `firm` and
+    `action` columns (and `ticker`, if it is one of the `keys`), and no
+    operation is applied to the strings of every row:
+
+    - The firm names are converted to upper case through their categories
+    - The event date is the normalized datetime of the recommendation
+    - The last recommendation of each group is selected by a stable sort
+      followed by `drop_duplicates`
+    - The event type is obtained from a lookup table with one element per
+      category of `action`
+
+    """
+    # Step 3.2. Create variables identifying the firm and the event date
+    # NOTE: `assign` replaces the columns (and their categories), which
+    # `.loc` cannot do
+    df = df.assign(
+            firm=_map_categories(df.loc[:, 'firm'], str.upper),
+            event_date=df.index.normalize())
+    if 'ticker' in keys:
+        df = df.assign(ticker=_map_categories(
+            df.loc[:, 'ticker'].astype('category'), str.lower))
+
+    # Step 3.3. Keep the last recommendation of each group. Categories are
+    # sorted, so the order of the groups is the same as in `groupby`.
+    # `groupby` drops the rows with a missing key and `last` skips missing
+    # actions, while `drop_duplicates` does neither
+    df = df.dropna(subset=list(keys) + ['action'])
+    df = df.sort_values(keys, kind='stable')
+    df = df.drop_duplicates(subset=keys, keep='last')
+
+    # Step 3.4. Create a table with all relevant events
+    # 3.4.1: Lookup table {<code of action> : <code of event type>}, where
+    # event types are 0 ("downgrade"), 1 ("upgrade") or -1 (not an event)
+    action = df.loc[:, 'action'].astype('category')
+    action = action.cat.remove_unused_categories()
+    acats = action.cat.categories
+    lookup = np.full(len(acats) + 1, -1)
+    for i, value in enumerate(acats):
+        if 'up' in value or 'down' in value:
+            if value == 'down':
+                lookup[i] = 0
+            elif value == 'up':
+                lookup[i] = 1
+            else:
+                raise Exception(f'Unknown value for column `action`: {value}')
+    et_codes = lookup[action.cat.codes.to_numpy()]
+
+    # 3.4.2: Subset the events and create the event type
+    is_event = et_codes >= 0
+    df = df.loc[is_event].assign(event_type=pd.Categorical.from_codes(
+        et_codes[is_event], categories=['downgrade', 'upgrade']))
+
+    # 3.4.3 Create the event id index and 3.4.4: Reorganise the columns
+    df.index = pd.RangeIndex(first_id, first_id + len(df), name='event_id')
+    return df.loc[:, cols]
+
+
+def iter_step3(rec_csv, chunksize=100000, panel=False):
+    """ Streaming version of `step3` (or `step3_panel`): reads the CSV file
+    with recommendations in chunks and yields the events of interest as
+    they become available.
+
+    The recommendations in the file must be sorted by date (recommendations
+    issued on the same day may appear in any order). All the recommendations
+    of a day are complete once a later day is read, so only the
+    recommendations of the last day read are kept between chunks. Peak
+    memory is therefore roughly one chunk, regardless of the size of the
+    file.
+
+    Parameters
+    ----------
+    rec_csv: str, buffer
+        Parameter to the passed to pd.read_csv (see `step3`)
+
+    chunksize : int, optional
+        Number of lines read at a time
+
+    panel : bool, optional
+        If True, the file includes a `ticker` column and events are selected
+        as in `step3_panel`. Default is False
+
+    Yields
+    ------
+    frame:
+        Data frames with the events of consecutive days, in the same format
+        as the output of `step3` (or `step3_panel`). Event IDs continue from
+        one data frame to the next.
+
+    """
+    if panel is True:
+        usecols = ['date', 'ticker', 'firm', 'action']
+        keys = ['event_date', 'ticker', 'firm']
+        cols = ['ticker', 'firm', 'event_date', 'event_type']
+    else:
+        usecols = ['date', 'firm', 'action']
+        keys = ['event_date', 'firm']
+        cols = ['firm', 'event_date', 'event_type']
+
+    reader = pd.read_csv(rec_csv,
+            index_col='date',
+            parse_dates=['date'],
+            usecols=usecols,
+            chunksize=chunksize)
+
+    pending = None  # recommendations of the last day read
+    next_id = 1
+    for chunk in reader:
+        # An empty file yields one empty chunk, without parsed dates
+        if len(chunk) == 0:
+            continue
+        if panel is True:
+            chunk.loc[:, 'ticker'] = chunk.loc[:, 'ticker'].str.lower()
+        chunk = _prep_recs(chunk)
+        if pending is not None:
+            pending_day = pending.iloc[0]['event_date']
+            if chunk.loc[:, 'event_date'].min() < pending_day:
+                raise Exception('Recommendations must be sorted by date')
+            chunk = pd.concat([pending, chunk])
+        chunk = chunk.sort_index(kind='stable')
+
+        # Days before the last day in this chunk are complete
+        last_day = chunk.loc[:, 'event_date'].max()
+        is_last = (chunk.loc[:, 'event_date'] == last_day).to_numpy()
+        pending = chunk.loc[is_last]
+        events = _last_events(chunk.loc[~is_last], keys, cols,
+                first_id=next_id)
+        del chunk
+        if len(events) > 0:
+            next_id += len(events)
+            yield events
+
+    if pending is not None:
+        events = _last_events(pending, keys, cols, first_id=next_id)
+        if len(events) > 0:
+            yield events
+
+
+def step3_chunked(rec_csv, chunksize=100000, panel=False):
+    """ Same as `step3` (or `step3_panel` if `panel` is True), but reads the
+    CSV file with recommendations in chunks of `chunksize` lines. See
+    `iter_step3`.
+    """
+    parts = list(iter_step3(rec_csv, chunksize=chunksize, panel=panel))
+    if len(parts) == 0:
+        cols = ['ticker', 'firm', 'event_date', 'event_type'] if panel \
+                else ['firm', 'event_date', 'event_type']
+        return pd.DataFrame(columns=cols, index=pd.Index([], name='event_id'))
+    return pd.concat(parts)
+
+
 # ----------------------------------------------------------------------------
 # Step 4: Calculate CARs for each event
 #
@@ -276,20 +644,33 @@ def step3(rec_csv):
 #
 # - The function `step4`:
 #
-#    - Applies the function `calc_car` to every row of `event_df`
+#    - Calls the function `calc_cars` once for all the events in `event_df`
+#
+#       calc_cars(event_df, ret_df, windows) --> data frame (CARs)
 #
-#       calc_car(row of event_df, ret_df) --> scalar (CAR)
+#    - The function `calc_cars`
 #
-#    - The function `calc_car`
+#       - Creates the trading calendar (`mk_trading_cal`)
+#       - Locates each event in the calendar with `searchsorted`
+#         (`event_positions`)
+#       - Estimates the market model for every event, if required
+#         (`calc_mm_params`)
+#       - Calculates the sum of abnormal returns (CAR) over the trading days
+#         in each event window from cumulative sums of returns
 #
-#       - Creates a data frame with "expanded" dates
-#       - Join returns from `ret_df`
-#       - Calculates the sum of abnormal returns (CAR)
+# - The per-row version (`calc_car` applied to every row of `event_df`)
+#   builds and joins one data frame per event, and measures the event window
+#   in calendar days instead of trading days.
 #
 # ----------------------------------------------------------------------------
-def step4(ret_df, event_df):
+@prof.profiled
+def step4(ret_df, event_df, windows=None, model='market_adj',
+        est_window=(-250, -30), non_trading='next', cache_dir=None,
+        method='car'):
     """ Calculate CARs for each event in `event_df`
 
+    Event windows are measured in trading days (see `mk_trading_cal`)
+
     Parameters
     ----------
     ret_df : pandas dataframe
@@ -317,6 +698,41 @@ def step4(ret_df, event_df):
 
         The index uniquely identifies each event (1, 2, ...)
 
+    windows : list, optional
+        A list of tuples (<first day>, <last day>) with the event windows, in
+        trading days relative to the event date, e.g. [(-1, 1), (0, 5)].
+        If None (default), only the CAR for the window (-2, 2) is computed
+        and stored in the column `car`.
+
+    model : str, optional
+        The model used to compute abnormal returns:
+        - "market_adj": ret - mkt (default)
+        - "market": ret - (alpha + beta * mkt), where alpha and beta are
+          estimated for each event by OLS over `est_window`
+
+    est_window : tuple, optional
+        The estimation window of the market model, in trading days relative
+        to the event date. Default is (-250, -30)
+
+    non_trading : str, optional
+        How to deal with events on non-trading days:
+        - "next": Day 0 is the next trading day (default)
+        - "prev": Day 0 is the previous trading day
+        - "drop": The CAR for this event is NaN
+
+    cache_dir : str, optional
+        Location of a folder with a persistent cache of CARs (see
+        `week10_cache`). If given, only the CARs not found in the cache (new
+        events, new windows or tickers with new returns) are computed
+
+    method : str, optional
+        How abnormal returns are aggregated over the event window:
+        - "car": cumulative (summed) abnormal returns (default)
+        - "bhar": buy-and-hold abnormal returns, i.e., the compounded stock
+          return minus the compounded market return. Only valid with the
+          market-adjusted model. The results are stored in the column
+          `bhar` (or "bhar(<first day>,<last day>)")
+
     Returns
     -------
     data frame
@@ -333,13 +749,31 @@ def step4(ret_df, event_df):
                 A string identifying the event as either an upgrade
                 ("upgrade") or downgrade ("downgrade")
             car : float
-                The CAR for the two-day window surrounding the event
+                The CAR for the window of two trading days surrounding the
+                event (only if `windows` is None)
+            car(<first day>,<last day>) : float
+                The CAR for each window in `windows`, e.g. "car(-1,+1)" (see
+                `car_col`)
         Same index as `event_df`
 
 
     """
-    cars = event_df.apply(calc_car, axis=1, ret_df=ret_df)
-    event_df.loc[:, 'car'] = cars
+    kargs = dict(model=model, est_window=est_window, non_trading=non_trading,
+            method=method)
+    if windows is None:
+        cols = [method]
+    else:
+        cols = [car_col(w, method=method) for w in windows]
+    if windows is None:
+        windows = [(-2, 2)]
+    if cache_dir is None:
+        cars = calc_cars(event_df, ret_df, windows=windows, **kargs)
+        cars = cars.to_numpy()
+    else:
+        cars = car_cache.cached_cars(calc_cars, event_df, ret_df, cache_dir,
+                windows=windows, **kargs)
+    for i, col in enumerate(cols):
+        event_df.loc[:, col] = cars[:, i]
     return event_df
 
 
@@ -431,10 +865,488 @@ def calc_car(ser, ret_df):
         return None
 
 
+def mk_trading_cal(ret_df):
+    """ Given a data frame with returns, create the trading calendar, i.e., a
+    series mapping each trading day to its integer position.
+
+    The trading calendar only needs to be created once for a given `ret_df`.
+    Event windows can then be measured in trading days and located with
+    `searchsorted` instead of joining calendar dates.
+
+    Parameters
+    ----------
+    ret_df : data frame
+        A data frame with stock and market returns. Either the output of
+        `step2`, indexed by a sorted DatetimeIndex with the trading days, or
+        the output of `step2_panel`, indexed by a sorted MultiIndex
+        (ticker, date). In the latter case, each ticker has its own trading
+        calendar, stored as a contiguous block of positions.
+
+    Returns
+    -------
+    series
+        A series with the position (0, 1, ...) of each trading day. The index
+        is the index of `ret_df`
+
+    """
+    if isinstance(ret_df.index, pd.MultiIndex):
+        idx = ret_df.index
+    else:
+        idx = pd.DatetimeIndex(ret_df.index, name='date')
+    if not idx.is_monotonic_increasing or not idx.is_unique:
+        raise Exception('The index of `ret_df` must be sorted and unique')
+    return pd.Series(np.arange(len(idx)), index=idx, name='pos')
+
+
+def _cal_blocks(trading_cal):
+    """ Returns an array with the block number (0, 1, ...) of each position
+    in the trading calendar. There is one block per ticker in panel
+    calendars and a single block otherwise.
+    """
+    if not isinstance(trading_cal.index, pd.MultiIndex):
+        return np.zeros(len(trading_cal), dtype=np.int64)
+    cal_tics = trading_cal.index.get_level_values(0).to_numpy()
+    return np.cumsum(np.r_[False, cal_tics[1:] != cal_tics[:-1]])
+
+
+def _event_blocks(trading_cal, tickers, size):
+    """ Returns a tuple (start, end) of arrays with the block of positions
+    [start, end) in the trading calendar corresponding to the ticker of each
+    of the `size` events. For single-stock calendars, the block is the whole
+    calendar.
+    """
+    n = len(trading_cal)
+    if not isinstance(trading_cal.index, pd.MultiIndex):
+        return np.zeros(size, dtype=np.int64), np.full(size, n)
+
+    if tickers is None:
+        raise Exception('`tickers` is required for panel trading calendars')
+    if n == 0:
+        return np.zeros(size, dtype=np.int64), np.zeros(size, dtype=np.int64)
+    cal_tics = trading_cal.index.get_level_values(0).to_numpy()
+    firsts = np.flatnonzero(np.diff(_cal_blocks(trading_cal), prepend=-1))
+    ends = np.r_[firsts[1:], n]
+    blk = pd.Index(cal_tics[firsts]).get_indexer(np.asarray(tickers))
+    start = np.where(blk >= 0, firsts[blk], 0)
+    end = np.where(blk >= 0, ends[blk], 0)
+    return start, end
+
+
+def event_positions(event_dates, trading_cal, non_trading='next',
+        tickers=None):
+    """ Returns the position of each event date in the trading calendar
+
+    Parameters
+    ----------
+    event_dates : series, array-like
+        Event dates (datetime or strings formatted as 'YYYY-MM-DD')
+
+    trading_cal : series
+        The trading calendar created by `mk_trading_cal`
+
+    non_trading : str, optional
+        How to deal with events on non-trading days (weekends, holidays):
+
+        - "next": Day 0 is the next trading day (default)
+        - "prev": Day 0 is the previous trading day
+        - "drop": The event is discarded
+
+    tickers : series, array-like, optional
+        The ticker of each event. Required if the trading calendar was
+        created from a panel of returns (see `step2_panel`)
+
+    Returns
+    -------
+    array
+        An integer array with the position of each event. The position is -1
+        if the event was discarded, if its ticker is not in the calendar or if
+        its date is outside the trading calendar of its ticker.
+
+    """
+    event_dates = pd.to_datetime(pd.Series(event_dates)).to_numpy()
+    start, end = _event_blocks(trading_cal, tickers, len(event_dates))
+
+    # Day numbers of the calendar and the events
+    if isinstance(trading_cal.index, pd.MultiIndex):
+        cal_dates = trading_cal.index.get_level_values(1)
+    else:
+        cal_dates = trading_cal.index
+    cal_days = cal_dates.to_numpy().astype('datetime64[D]').astype(np.int64)
+    event_days = event_dates.astype('datetime64[D]').astype(np.int64)
+    return _positions(cal_days, _cal_blocks(trading_cal), start, end,
+            event_days, non_trading=non_trading)
+
+
+def _positions(cal_days, blocks, start, end, event_days, non_trading='next'):
+    """ Returns the position of each event in a trading calendar given as
+    arrays (see `event_positions`)
+
+    Parameters
+    ----------
+    cal_days : array
+        Day number of each position of the calendar, sorted within each
+        block
+
+    blocks : array
+        Block number (0, 1, ...) of each position of the calendar, in
+        increasing order (see `_cal_blocks`)
+
+    start, end : array
+        The block of positions [start, end) of the ticker of each event (see
+        `_event_blocks`)
+
+    event_days : array
+        Day number of each event
+
+    non_trading : str, optional
+        See `event_positions`
+
+    """
+    if non_trading not in ('next', 'prev', 'drop'):
+        raise Exception(f'Unknown value for `non_trading`: {non_trading}')
+
+    # Sort key (block, day) of each position: blocks are numbered in the
+    # order they appear, and days are offset so that events outside the
+    # calendar still sort inside their block
+    n = len(cal_days)
+    if n == 0:
+        # No trading days: no event can be placed
+        return np.full(len(event_days), -1)
+    day_min, day_max = cal_days.min(), cal_days.max()
+    span = day_max - day_min + 3
+    cal_keys = blocks * span + (cal_days - day_min + 1)
+    ev_blocks = blocks[np.minimum(start, n - 1)]
+    ev_keys = ev_blocks * span + np.clip(event_days - day_min + 1, 0, span - 1)
+
+    # Binary search of each event date in the trading calendar
+    left = cal_keys.searchsorted(ev_keys, side='left')
+    right = cal_keys.searchsorted(ev_keys, side='right')
+    is_trading = right > left
+
+    if non_trading == 'next':
+        pos = left
+    elif non_trading == 'prev':
+        pos = right - 1
+    else:
+        pos = np.where(is_trading, left, -1)
+
+    # Events outside the calendar of their ticker cannot be placed
+    has_block = end > start
+    first = cal_days[np.minimum(start, n - 1)]
+    last = cal_days[np.maximum(end - 1, 0)]
+    outside = ~has_block | (event_days < first) | (event_days > last)
+    pos[outside] = -1
+    return pos
+
+
+def car_col(window, method='car'):
+    """ Returns the name of the column with the CARs for `window`, e.g.
+    "car(-1,+1)" for the window (-1, 1) or "car(0,+5)" for the window (0, 5).
+    If `method` is "bhar", the name starts with "bhar" instead
+    """
+    lo, hi = (f'{t:+d}' if t != 0 else '0' for t in window)
+    return f'{method}({lo},{hi})'
+
+
+def _csum(values):
+    """ Cumulative sum of `values` starting at zero, so that the sum over
+    positions [start, end) is csum[end] - csum[start]
+    """
+    return np.concatenate([[0.0], np.cumsum(values)])
+
+
+def _csum_finite(values):
+    """ Returns a tuple (csum, nbad) with the cumulative sums (see `_csum`)
+    of the finite elements of `values` and of the number of non-finite
+    elements (NaN, inf). Non-finite values are left out of `csum`, so they
+    only affect the sums over windows that include them (see `_window_sum`)
+    """
+    bad = ~np.isfinite(values)
+    return _csum(np.where(bad, 0.0, values)), _csum(bad)
+
+
+def _window_sum(csum, nbad, start, end):
+    """ Sum over the positions [start, end) from the cumulative sums created
+    by `_csum_finite`. The sum is NaN if the window includes a non-finite
+    value
+    """
+    res = csum[end] - csum[start]
+    res[(nbad[end] - nbad[start]) > 0] = np.nan
+    return res
+
+
+def _log_growth(values, ret_type='simple'):
+    """ Returns a tuple (growth, wiped) where `growth` is log(1 + ret) for the
+    returns in `values` (the returns themselves if `ret_type` is "log") and
+    `wiped` is True for returns of -100% (or less), i.e., a log return of
+    -inf. These are set to 0 in `growth`, so they do not spread to other
+    windows through the cumulative sums, and the compounded return of the
+    windows that include them is set to -1 by `_window_compound`
+    """
+    if ret_type == 'simple':
+        wiped = values <= -1
+        growth = np.log1p(np.where(wiped, 0.0, values))
+    else:
+        wiped = values == -np.inf
+        growth = np.where(wiped, 0.0, values)
+    return growth, wiped
+
+
+def _window_compound(csum, nbad, nwiped, start, end):
+    """ Compounded return over the positions [start, end) from the cumulative
+    sums of log growth (see `_log_growth` and `_csum_finite`) and of wiped
+    out returns `nwiped`. The compounded return is -1 if the window includes
+    a return of -100%, and NaN if it includes a non-finite value
+    """
+    sum_growth = _window_sum(csum, nbad, start, end)
+    res = np.expm1(sum_growth)
+    res[((nwiped[end] - nwiped[start]) > 0) & ~np.isnan(sum_growth)] = -1.0
+    return res
+
+
+def calc_mm_params(ret_df, pos, est_window=(-250, -30), min_est_obs=30,
+        bounds=None):
+    """ Estimate the market model
+
+        ret = alpha + beta * mkt + e
+
+    by OLS over the estimation window of every event at once.
+
+    Instead of running one regression per event, the sums required by the OLS
+    estimator (sum of ret, mkt, ret*mkt, mkt^2) are computed for all
+    estimation windows from cumulative sums of these series.
+
+    Parameters
+    ----------
+    ret_df : data frame
+        A data frame with stock and market returns (output of `step2`)
+
+    pos : array
+        The position of each event in the trading calendar of `ret_df` (see
+        `event_positions`). Events with a negative position are ignored.
+
+    est_window : tuple, optional
+        The first and last day of the estimation window, in trading days
+        relative to the event date. Default is (-250, -30)
+
+    min_est_obs : int, optional
+        Minimum number of returns in the estimation window. The parameters
+        are NaN for events with fewer observations. Default is 30
+
+    bounds : tuple, optional
+        A tuple (start, end) of arrays with the block of positions
+        [start, end) holding the returns of the ticker of each event. If
+        None, every event uses all the positions in `ret_df`
+
+    Returns
+    -------
+    tuple
+        A tuple (alpha, beta) of arrays with one element per event
+
+    """
+    lo, hi = est_window
+    if lo > hi:
+        raise Exception(f'Invalid estimation window: {est_window}')
+    y = ret_df.loc[:, 'ret'].to_numpy()
+    x = ret_df.loc[:, 'mkt'].to_numpy()
+    if bounds is None:
+        bounds = (0, len(y))
+    first, last = bounds
+
+    # Slice of the estimation window of each event
+    start = np.clip(pos + lo, first, last)
+    end = np.clip(pos + hi + 1, first, last)
+    start = np.minimum(start, end)
+
+    # Days with a non-finite return are left out of the estimation window
+    valid = np.isfinite(y) & np.isfinite(x)
+    y, x = np.where(valid, y, 0.0), np.where(valid, x, 0.0)
+    csum_valid = _csum(valid)
+    nobs = np.where(pos >= 0, csum_valid[end] - csum_valid[start], 0)
+
+    sums = []
+    for values in (y, x, x * y, x * x):
+        csum = _csum(values)
+        sums.append(csum[end] - csum[start])
+    sy, sx, sxy, sxx = sums
+
+    # OLS estimates from the sums
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sxx_dm = nobs * sxx - sx ** 2
+        beta = (nobs * sxy - sx * sy) / sxx_dm
+        alpha = (sy - beta * sx) / nobs
+    invalid = (nobs < max(min_est_obs, 2)) | ~(sxx_dm > 0)
+    alpha[invalid] = np.nan
+    beta[invalid] = np.nan
+    return alpha, beta
+
+
+def calc_cars(event_df, ret_df, windows=((-2, 2),), model='market_adj',
+        est_window=(-250, -30), min_est_obs=30, non_trading='next',
+        trading_cal=None, method='car', ret_type=None):
+    """ Compute cumulative abnormal returns for one or more event windows of
+    every event in `event_df` at once.
+
+    Event windows are measured in trading days: for an event on day 0, the
+    window (-2, 2) includes the two trading days before and the two trading
+    days after the event. Each window is resolved to a contiguous slice of
+    positions in the trading calendar and sums over the window are the
+    difference between two elements of a cumulative sum. The cumulative sums
+    are computed once, so each additional window only costs a few
+    subtractions per event.
+
+    Parameters
+    ----------
+    event_df : data frame
+        A data frame with the events of interest (output of `step3` or
+        `step3_panel`). Must include the column `event_date`, and the column
+        `ticker` if `ret_df` is a panel
+
+    ret_df : data frame
+        A data frame with stock and market returns (output of `step2` or
+        `step2_panel`). In panel mode, each event is resolved against the
+        returns of its own ticker
+
+    windows : list, optional
+        A list of tuples (<first day>, <last day>) with the event windows, in
+        trading days relative to the event date. Default is [(-2, 2)]
+
+    model : str, optional
+        The model for the normal return:
+
+        - "market_adj": market-adjusted model, the abnormal return is
+          ret - mkt (default)
+        - "market": market model, the abnormal return is
+          ret - (alpha + beta * mkt), with alpha and beta estimated for each
+          event over `est_window` (see `calc_mm_params`)
+
+    est_window : tuple, optional
+        Estimation window of the market model. Default is (-250, -30)
+
+    min_est_obs : int, optional
+        Minimum number of returns in the estimation window of the market
+        model. Default is 30
+
+    non_trading : str, optional
+        How to deal with events on non-trading days. See `event_positions`
+
+    trading_cal : series, optional
+        The trading calendar created by `mk_trading_cal`. If None, it will be
+        created from `ret_df`
+
+    method : str, optional
+        - "car": sum of abnormal returns over the window (default)
+        - "bhar": buy-and-hold abnormal return over the window,
+
+            prod(1 + ret) - prod(1 + mkt)
+
+          computed from cumulative sums of log(1 + ret) and log(1 + mkt), so
+          the products over every window cost two subtractions per event.
+          The compounded return of a window with a return of -100% is -1.
+          Only valid with the market-adjusted model
+
+    ret_type : str, optional
+        The type of returns in `ret_df`, "simple" or "log". If None, use
+        `ret_df.attrs['ret_type']` (set by `step2` and `step2_panel`), or
+        "simple" if missing
+
+    Returns
+    -------
+    data frame
+        A data frame with one column per window (named by `car_col`) and the
+        same index as `event_df`. Windows extending beyond the available
+        returns are truncated. The CAR is NaN if the event could not be
+        placed in the trading calendar, if the window has no returns or if
+        the market model could not be estimated.
+
+    """
+    if ret_type is None:
+        ret_type = ret_df.attrs.get('ret_type', 'simple')
+    if trading_cal is None:
+        trading_cal = mk_trading_cal(ret_df)
+    if isinstance(trading_cal.index, pd.MultiIndex):
+        tickers = event_df.loc[:, 'ticker'].to_numpy()
+    else:
+        tickers = None
+    pos = event_positions(event_df.loc[:, 'event_date'], trading_cal,
+            non_trading=non_trading, tickers=tickers)
+
+    # Windows are truncated to the positions of the ticker of each event
+    bounds = _event_blocks(trading_cal, tickers, len(pos))
+    cars = _block_cars(ret_df, pos, bounds, windows=windows, model=model,
+            est_window=est_window, min_est_obs=min_est_obs, method=method,
+            ret_type=ret_type)
+    return pd.DataFrame(cars, index=event_df.index)
+
+
+def _block_cars(ret_df, pos, bounds, windows=((-2, 2),), model='market_adj',
+        est_window=(-250, -30), min_est_obs=30, method='car',
+        ret_type='simple'):
+    """ Returns a dictionary {<car_col> : <array>} with the abnormal returns
+    of the events at positions `pos` of `ret_df` (see `calc_cars`)
+
+    `ret_df` only needs the columns `ret` and `mkt`. `bounds` is a tuple
+    (first, last) of arrays with the block of positions [first, last)
+    holding the returns of the ticker of each event (see `_event_blocks`).
+    """
+    if model not in ('market_adj', 'market'):
+        raise Exception(f'Unknown value for `model`: {model}')
+    if method not in ('car', 'bhar'):
+        raise Exception(f'Unknown value for `method`: {method}')
+    if method == 'bhar' and model != 'market_adj':
+        raise Exception('BHARs require the market-adjusted model')
+    if ret_type not in ('simple', 'log'):
+        raise Exception(f'Unknown value for `ret_type`: {ret_type}')
+    first, last = bounds
+    placed = pos >= 0
+
+    # Cumulative sums of stock and market returns. BHARs compound returns,
+    # i.e., they add up log returns
+    ret = ret_df.loc[:, 'ret'].to_numpy(dtype=np.float64)
+    mkt = ret_df.loc[:, 'mkt'].to_numpy(dtype=np.float64)
+    if method == 'bhar':
+        ret, wiped_ret = _log_growth(ret, ret_type)
+        mkt, wiped_mkt = _log_growth(mkt, ret_type)
+        nwiped_ret, nwiped_mkt = _csum(wiped_ret), _csum(wiped_mkt)
+    # Non-finite returns (e.g. inf after a zero price) only affect the
+    # windows that include them, not later windows or other tickers
+    csum_ret, nbad_ret = _csum_finite(ret)
+    csum_mkt, nbad_mkt = _csum_finite(mkt)
+
+    if model == 'market':
+        alpha, beta = calc_mm_params(ret_df, pos, est_window=est_window,
+                min_est_obs=min_est_obs, bounds=(first, last))
+    else:
+        alpha, beta = np.zeros(len(pos)), np.ones(len(pos))
+
+    cars = {}
+    for lo, hi in windows:
+        if lo > hi:
+            raise Exception(f'Invalid event window: {(lo, hi)}')
+        start = np.clip(pos + lo, first, last)
+        end = np.clip(pos + hi + 1, first, last)
+        nobs = end - start
+        if method == 'bhar':
+            # Compounded stock return minus compounded market return
+            car = (_window_compound(csum_ret, nbad_ret, nwiped_ret, start, end)
+                    - _window_compound(csum_mkt, nbad_mkt, nwiped_mkt, start,
+                        end))
+        else:
+            # Sum of ret - (alpha + beta * mkt) over the window
+            sum_ret = _window_sum(csum_ret, nbad_ret, start, end)
+            sum_mkt = _window_sum(csum_mkt, nbad_mkt, start, end)
+            car = sum_ret - alpha * nobs - beta * sum_mkt
+        # Only report a CAR if we have at least one obs
+        car[~placed | (nobs <= 0)] = np.nan
+        cars[car_col((lo, hi), method=method)] = car
+    return cars
+
+
 # --------------------------------------------------------
 #   Step 5: calculate t-stats
 # --------------------------------------------------------
-def step5(cars_df):
+@prof.profiled
+def step5(cars_df, n_resamples=0, seed=None, workers=None, col='car'):
     """ Given a data frame with CARs and the event type for each event 
     in the sample, compute a t-stat for each event type 
 
@@ -446,16 +1358,33 @@ def step5(cars_df):
         - event_type
         - car
 
+    n_resamples : int, optional
+        If positive, also compute bootstrap and sign-permutation p-values
+        using `n_resamples` resamples for each event type (see
+        `week10_stats.resample_pvalue`). Default is 0
+
+    seed : int, optional
+        Seed for the random number generator used by the resampling tests
+
+    workers : int, optional
+        Number of threads used by the resampling tests
+
+    col : str, optional
+        The column with the abnormal returns, e.g. "bhar" for the output of
+        `step4(..., method='bhar')`. Default is "car"
+
     Returns
     -------
     frame:
-        A data frame with the t-stat for each event type
+        A data frame with the t-stat for each event type. If `n_resamples`
+        is positive, it includes the columns `p_boot` and `p_perm` with the
+        p-values of the resampling tests.
 
 
     """
 
     # Separate between upgrades and downgrades
-    groups = cars_df.groupby('event_type')['car']
+    groups = cars_df.groupby('event_type')[col]
 
     # Mean
     car_bar  = groups.mean()
@@ -471,9 +1400,220 @@ def step5(cars_df):
 
     # Construct the result data frame
     res = pd.DataFrame({'car_bar':car_bar, 'tstat': tstat, 'n_obs': car_n})
+
+    # Resampling tests, with an independent random stream for each group
+    if n_resamples > 0:
+        seeds = np.random.SeedSequence(seed).spawn(len(res))
+        for method, res_col in [('boot', 'p_boot'), ('perm', 'p_perm')]:
+            res.loc[:, res_col] = [
+                    stats.resample_pvalue(cars, method=method,
+                        n_resamples=n_resamples, seed=group_seed,
+                        workers=workers)
+                    for (_, cars), group_seed in zip(groups, seeds)]
     return res
 
 
+# ----------------------------------------------------------------------------
+#   Panel event study: steps 2 to 4 for many tickers in one run
+#
+# - Returns are stored in a "long" data frame indexed by (ticker, date),
+#   sorted so that the returns of each ticker form a contiguous block
+# - Events include a `ticker` column
+# - `calc_cars` resolves every event against the block of its own ticker, so
+#   CARs for all tickers are computed in a single vectorized pass
+# ----------------------------------------------------------------------------
+@prof.profiled
+def step2_panel(prc_csvs, mkt_csv, cache=False, ret_type='simple',
+        max_workers=None, max_open=None, progress=None):
+    """ Given CSV files with stock prices for many tickers and a CSV file with
+    market returns, create a data frame with stock and market returns for
+    all tickers
+
+    Parameters
+    ----------
+    prc_csvs : dict
+        A dictionary with format {<tic> : <prc_csv>}, where each <prc_csv> is
+        a parameter to be passed to pd.read_csv (see `step2`)
+
+    mkt_csv: str, buffer
+        Parameter to the passed to pd.read_csv (see `step2`). The market
+        returns are read only once.
+
+    cache : bool, optional
+        If True, use columnar cache files for the CSV files (see `step2`)
+
+    ret_type : str, optional
+        "simple" (default) or "log" returns (see `step2`)
+
+    max_workers : int, optional
+        Number of threads used to read the price files. If None, files are
+        read one at a time (see `week10_io.read_many`)
+
+    max_open : int, optional
+        Maximum number of price files read at the same time
+
+    progress : function, optional
+        Function called as `progress(<done>, <total>, <tic>)` after each
+        price file is read
+
+    Returns
+    -------
+    data frame:
+        A data frame with stock returns (ret) and market returns (mkt). The
+        index is a sorted MultiIndex (ticker, date), with tickers in lower
+        case. The type of returns is stored in `df.attrs['ret_type']`
+
+    """
+    read_csv = week10_io.read_csv_cached if cache is True else pd.read_csv
+    mkt_df = read_csv(mkt_csv, index_col='date', parse_dates=['date'])
+    if ret_type == 'log':
+        mkt_df = np.log1p(mkt_df.loc[:, ['mkt']])
+
+    # Compute the returns of each ticker
+    def _read_rets(prc_csv):
+        df = read_csv(prc_csv,
+                index_col='date',
+                parse_dates=['date'],
+                usecols=['date', 'close'])
+        df.sort_index(inplace=True)
+        return _calc_rets(df.loc[:, 'close'], ret_type)
+
+    rets = week10_io.read_many(prc_csvs, _read_rets, max_workers=max_workers,
+            max_open=max_open, progress=progress)
+    rets = {tic.lower(): ret for tic, ret in rets.items()}
+
+    # Stack all returns and join market returns
+    ret = pd.concat(rets, names=['ticker', 'date']).rename('ret')
+    df = ret.to_frame().join(mkt_df, how='inner')
+
+    cols = ['mkt', 'ret']
+    df = df.loc[:, cols].dropna().sort_index()
+    df.attrs['ret_type'] = ret_type
+    return df
+
+
+def panel_to_matrix(ret_df):
+    """ Given a panel of returns (output of `step2_panel`), returns a tuple
+    (ret_mat, mkt) where
+
+    - ret_mat is a data frame (dates x tickers) with stock returns, NaN if
+      the ticker has no return on a given day. Rows are sorted by date
+    - mkt is a series with the market return of each date in `ret_mat`
+
+    """
+    # `unstack` does not sort the dates when tickers have different
+    # calendars
+    ret_mat = ret_df.loc[:, 'ret'].unstack('ticker').sort_index()
+    mkt = ret_df.loc[:, 'mkt'].groupby(level='date').first()
+    return ret_mat, mkt.reindex(ret_mat.index)
+
+
+def matrix_to_panel(ret_mat, mkt):
+    """ Inverse of `panel_to_matrix`: given a data frame (dates x tickers)
+    with stock returns and a series with market returns, returns a panel of
+    returns as created by `step2_panel`
+    """
+    ret = ret_mat.stack().rename('ret')
+    ret.index.names = ['date', 'ticker']
+    df = ret.to_frame().join(mkt.rename('mkt'), how='inner')
+    df = df.reorder_levels(['ticker', 'date'])
+    cols = ['mkt', 'ret']
+    return df.loc[:, cols].dropna().sort_index()
+
+
+@prof.profiled
+def step3_panel(rec_csv, categorical=False, align=None):
+    """ Given a CSV file with recommendations for many tickers, create a data
+    frame with the events of interest
+
+    Events are selected as in `step3`, but the last recommendation is kept
+    for each ticker, firm and day.
+
+    Parameters
+    ----------
+    rec_csv: str, buffer
+        Parameter to the passed to pd.read_csv. The file must include the
+        following columns:
+
+        - date
+        - ticker
+        - firm
+        - action
+
+    categorical : bool, optional
+        If True, select events using categorical columns (see `step3`)
+
+    align : dict, optional
+        If not None, assign recommendations to trading sessions (see
+        `step3`)
+
+    Returns
+    -------
+    frame:
+        A data frame with the following columns:
+
+        - ticker (in lower case)
+        - firm (in upper case)
+        - event_date (datetime)
+        - event_type ("upgrade"/"downgrade")
+
+        The index should be called event_id and start at 1
+
+    """
+    usecols = ['date', 'ticker', 'firm', 'action']
+    dtype = {'ticker': 'category', 'firm': 'category',
+            'action': 'category'} if categorical else None
+    df = pd.read_csv(rec_csv,
+            index_col='date',
+            parse_dates=['date'],
+            usecols=usecols,
+            dtype=dtype)
+    df.sort_index(inplace=True)
+    if align is not None:
+        df.index = align_sessions(df.index, **align)
+
+    keys = ['event_date', 'ticker', 'firm']
+    cols = ['ticker', 'firm', 'event_date', 'event_type']
+    if categorical is True:
+        return _select_events_cat(df, keys=keys, cols=cols)
+    df.loc[:, 'ticker'] = df.loc[:, 'ticker'].str.lower()
+    return _select_events(df, keys=keys, cols=cols)
+
+
+def step4_panel(ret_df, event_df, windows=None, model='market_adj',
+        est_window=(-250, -30), non_trading='next', cache_dir=None,
+        method='car'):
+    """ Calculate CARs for each event in `event_df`, using the returns of the
+    ticker of each event
+
+    Parameters
+    ----------
+    ret_df : data frame
+        A panel of returns (output of `step2_panel`)
+
+    event_df : data frame
+        A data frame with the events of interest (output of `step3_panel`)
+
+    windows, model, est_window, non_trading, cache_dir, method
+        See `step4`
+
+    Returns
+    -------
+    data frame
+        A data frame with the same format as `event_df` but with additional
+        column(s) containing the CARs (see `step4`). The CAR is NaN for
+        events whose ticker is not in `ret_df`.
+
+    """
+    if not isinstance(ret_df.index, pd.MultiIndex):
+        raise Exception('`ret_df` must be indexed by (ticker, date)')
+    if 'ticker' not in event_df.columns:
+        raise Exception('`event_df` must include the column `ticker`')
+    return step4(ret_df, event_df, windows=windows, model=model,
+            est_window=est_window, non_trading=non_trading,
+            cache_dir=cache_dir, method=method)
+
+
 # ----------------------------------------------------------------------------
 #   Main function 
 # ----------------------------------------------------------------------------
@@ -0,0 +1,121 @@
+""" week10_stats.py
+
+Resampling tests for the mean CAR used in step 5 of the event study (see
+`week10_slides_main.step5`)
+
+    toolkit/
+    |   ...
+    |__ webinars/
+    |   |__ week10/
+    |   |   |__ __init__.py
+    |   |   |__ week10_slides_main.py
+    |   |   |__ week10_stats.py           <- This module
+    |   |__ lec_utils.py            <- Required
+
+Both tests below draw all the resamples of a group as a single matrix
+(resamples x events) and compute the mean of every resample with one call
+to `mean(axis=1)`. To bound memory, the matrix is processed in blocks of at
+most `max_block_elems` elements. Each block has its own random generator,
+spawned from `seed`, so the p-values do not depend on the number of
+workers.
+
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def _block_sizes(n_resamples, n_obs, max_block_elems):
+    """ Split `n_resamples` into blocks of at most `max_block_elems`
+    elements (resamples x n_obs)
+    """
+    rows = max(1, max_block_elems // max(n_obs, 1))
+    sizes = [rows] * (n_resamples // rows)
+    if n_resamples % rows > 0:
+        sizes.append(n_resamples % rows)
+    return sizes
+
+
+def _boot_block(x, size, seed):
+    """ Mean of `size` bootstrap resamples of `x` """
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, len(x), size=(size, len(x)))
+    return x[idx].mean(axis=1)
+
+
+def _perm_block(x, size, seed):
+    """ Mean of `size` random sign flips of `x` """
+    rng = np.random.default_rng(seed)
+    signs = rng.integers(0, 2, size=(size, len(x)), dtype=np.int8) * 2 - 1
+    return (signs * x).mean(axis=1)
+
+
+def resample_pvalue(x, method='boot', n_resamples=10000, seed=None,
+        workers=None, max_block_elems=2**22):
+    """ Two-sided p-value for the null hypothesis that the mean of `x` is
+    zero, computed by resampling
+
+    Parameters
+    ----------
+    x : array-like
+        The CARs of a group of events. NaN values are ignored
+
+    method : str, optional
+        - "boot": bootstrap test. Resamples are drawn with replacement from
+          `x` after subtracting its mean, so that the null hypothesis holds
+          (default)
+        - "perm": sign-permutation test. Each resample flips the sign of
+          every observation at random, which is valid if the distribution of
+          `x` is symmetric around zero under the null hypothesis
+
+    n_resamples : int, optional
+        Number of resamples. Default is 10000
+
+    seed : int, SeedSequence, optional
+        Seed for the random number generator
+
+    workers : int, optional
+        Number of threads used to process the blocks of resamples. If None,
+        blocks are processed sequentially
+
+    max_block_elems : int, optional
+        Maximum number of elements (resamples x observations) drawn at once
+
+    Returns
+    -------
+    float
+        The p-value, computed as (1 + <number of resamples with a mean at
+        least as large as the mean of `x` in absolute value>) /
+        (1 + n_resamples). NaN if `x` has less than two observations.
+
+    """
+    x = np.asarray(x, dtype=np.float64)
+    x = x[~np.isnan(x)]
+    if len(x) < 2:
+        return np.nan
+
+    xbar = x.mean()
+    if method == 'boot':
+        func, data = _boot_block, x - xbar
+    elif method == 'perm':
+        func, data = _perm_block, x
+    else:
+        raise Exception(f'Unknown value for `method`: {method}')
+
+    sizes = _block_sizes(n_resamples, len(x), max_block_elems)
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    seeds = seed.spawn(len(sizes))
+
+    def _count(args):
+        size, block_seed = args
+        means = func(data, size, block_seed)
+        return int(np.count_nonzero(np.abs(means) >= abs(xbar)))
+
+    if workers is None or workers <= 1:
+        counts = map(_count, zip(sizes, seeds))
+        extreme = sum(counts)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            extreme = sum(executor.map(_count, zip(sizes, seeds)))
+    return (1 + extreme) / (1 + n_resamples)
@@ -0,0 +1,401 @@
+""" week10_store.py
+
+Memory-mapped store of daily returns (dates x tickers) for the panel event
+study in `week10_slides_main`
+
+    toolkit/
+    |   ...
+    |__ data/
+    |   |__ <tic>_prc.csv           <- Price files read by `build_store`
+    |   |__ ret_store/              <- Default location of the store
+    |__ webinars/
+    |   |__ week10/
+    |   |   |__ __init__.py
+    |   |   |__ week10_slides_main.py
+    |   |   |__ week10_store.py           <- This module
+    |   |__ lec_utils.py            <- Required
+    |__ toolkit_config.py           <- Required
+
+The price files are read once by `build_store`, which writes the following
+files to the store folder:
+
+    ret.f64     float64 matrix (dates x tickers) with the stock returns, NaN
+                if a ticker has no return on a given date (np.memmap)
+    mkt.npy     market return of each date
+    dates.npy   dates of the rows of the matrix (datetime64[ns])
+    meta.json   shape of the matrix, tickers (columns) and type of returns
+
+`store_cars` maps `ret.f64` in read-only mode and gathers the returns in the
+event windows with a single fancy-indexing operation, so only the pages
+holding these returns are read from disk. Processes using the same store
+share these pages through the OS page cache. Event windows are measured in
+the trading days of each ticker (the rows with a return), as in
+`week10_slides_main.calc_cars`: the few events whose window spans gaps in
+the returns of their ticker are gathered again with a wider block of rows.
+
+Usage
+-----
+
+>> build_store(mkt_csv='mkt.csv')
+>> event_df = week10_slides_main.step3_panel(rec_csv)
+>> cars_df = store_cars(event_df, windows=[(-1, 1), (-2, 2)])
+
+"""
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import toolkit_config as cfg
+from webinars.week10 import week10_slides_main as es
+
+
+STORE_DIR = os.path.join(cfg.DATADIR, 'ret_store')
+
+RET_FILE = 'ret.f64'
+MKT_FILE = 'mkt.npy'
+DATES_FILE = 'dates.npy'
+META_FILE = 'meta.json'
+
+
+# ----------------------------------------------------------------------------
+#   Building the store
+# ----------------------------------------------------------------------------
+def find_prc_csvs(datadir=None, pattern='*_prc.csv'):
+    """ Returns a dictionary {<tic> : <pth>} with the price files in
+    `datadir` (cfg.DATADIR by default) matching `pattern`. The ticker is the
+    part of the file name before "_prc", e.g. "tsla" for "tsla_prc.csv"
+    """
+    if datadir is None:
+        datadir = cfg.DATADIR
+    res = {}
+    for pth in sorted(glob.glob(os.path.join(datadir, pattern))):
+        name = os.path.basename(pth)
+        res[name.split('_prc')[0].lower()] = pth
+    return res
+
+
+def _read_close(prc_csv):
+    """ Returns a series with the close prices in `prc_csv`, indexed by
+    date. Column names are not case sensitive (e.g. "Close" or "close")
+    """
+    df = pd.read_csv(prc_csv)
+    df.columns = [col.strip().lower().replace(' ', '_') for col in df.columns]
+    dates = pd.DatetimeIndex(pd.to_datetime(df.loc[:, 'date']), name='date')
+    ser = pd.Series(df.loc[:, 'close'].to_numpy(dtype=np.float64),
+            index=dates)
+    ser = ser.sort_index()
+    return ser.loc[~ser.index.duplicated(keep='last')]
+
+
+def build_store(mkt_csv, prc_csvs=None, store_dir=None, ret_type='simple'):
+    """ Reads the price files in `prc_csvs` and saves the returns of all the
+    tickers to a memory-mapped store (see the module docstring)
+
+    Parameters
+    ----------
+    mkt_csv : str, buffer
+        Parameter to the passed to pd.read_csv. A CSV file with market
+        returns (see `week10_slides_main.step2`)
+
+    prc_csvs : dict, optional
+        A dictionary with format {<tic> : <prc_csv>}. If None, use all the
+        price files under cfg.DATADIR (see `find_prc_csvs`)
+
+    store_dir : str, optional
+        Location of the store. Default is `STORE_DIR`
+
+    ret_type : str, optional
+        "simple" (default) or "log" returns (see `week10_slides_main.step2`)
+
+    Returns
+    -------
+    str
+        The location of the store
+
+    """
+    if store_dir is None:
+        store_dir = STORE_DIR
+    if prc_csvs is None:
+        prc_csvs = find_prc_csvs()
+    if len(prc_csvs) == 0:
+        raise Exception('No price files to store')
+
+    mkt = pd.read_csv(mkt_csv, index_col='date', parse_dates=['date'])
+    mkt = mkt.loc[:, 'mkt'].sort_index()
+    mkt = mkt.loc[~mkt.index.duplicated(keep='last')].dropna()
+    if ret_type == 'log':
+        mkt = np.log1p(mkt)
+
+    # Returns of each ticker (one column at a time, as in `step2_panel`)
+    rets = {}
+    for tic, prc_csv in prc_csvs.items():
+        ret = es._calc_rets(_read_close(prc_csv), ret_type)
+        rets[tic.lower()] = ret.dropna()
+    tickers = sorted(rets.keys())
+
+    # Rows are the dates with market returns and at least one stock return
+    dates = pd.DatetimeIndex(sorted(set().union(
+        *[ret.index for ret in rets.values()])))
+    dates = dates.intersection(mkt.index)
+
+    os.makedirs(store_dir, exist_ok=True)
+    # Without a meta file, the store is incomplete
+    meta_pth = os.path.join(store_dir, META_FILE)
+    if os.path.exists(meta_pth):
+        os.remove(meta_pth)
+
+    shape = (len(dates), len(tickers))
+    ret_pth = os.path.join(store_dir, RET_FILE)
+    if shape[0] * shape[1] > 0:
+        mat = np.memmap(ret_pth, dtype=np.float64, mode='w+', shape=shape)
+        for j, tic in enumerate(tickers):
+            mat[:, j] = rets[tic].reindex(dates).to_numpy()
+        mat.flush()
+        del mat
+    else:
+        # np.memmap cannot create an empty file
+        open(ret_pth, mode='wb').close()
+
+    np.save(os.path.join(store_dir, MKT_FILE),
+            mkt.reindex(dates).to_numpy(dtype=np.float64))
+    np.save(os.path.join(store_dir, DATES_FILE),
+            dates.to_numpy().astype('datetime64[ns]'))
+    meta = {'shape': list(shape), 'tickers': tickers, 'ret_type': ret_type}
+    with open(meta_pth, mode='wt') as fobj:
+        json.dump(meta, fobj)
+    return store_dir
+
+
+# ----------------------------------------------------------------------------
+#   Reading the store
+# ----------------------------------------------------------------------------
+def open_store(store_dir=None):
+    """ Returns a tuple (ret_mat, mkt, dates, tickers, ret_type) where
+
+    - ret_mat is a read-only np.memmap (dates x tickers) with stock returns
+    - mkt is an array with the market return of each date
+    - dates is a DatetimeIndex with the dates of the rows of `ret_mat`
+    - tickers is an Index with the tickers of the columns of `ret_mat`
+    - ret_type is the type of returns ("simple" or "log")
+
+    """
+    if store_dir is None:
+        store_dir = STORE_DIR
+    meta_pth = os.path.join(store_dir, META_FILE)
+    if not os.path.exists(meta_pth):
+        raise Exception(f'No return store in {store_dir}')
+    with open(meta_pth, mode='rt') as fobj:
+        meta = json.load(fobj)
+
+    shape = tuple(meta['shape'])
+    if shape[0] * shape[1] > 0:
+        ret_mat = np.memmap(os.path.join(store_dir, RET_FILE),
+                dtype=np.float64, mode='r', shape=shape)
+    else:
+        # np.memmap cannot map an empty file
+        ret_mat = np.empty(shape, dtype=np.float64)
+    mkt = np.load(os.path.join(store_dir, MKT_FILE))
+    dates = pd.DatetimeIndex(np.load(os.path.join(store_dir, DATES_FILE)),
+            name='date')
+    tickers = pd.Index(meta['tickers'], name='ticker')
+    return ret_mat, mkt, dates, tickers, meta['ret_type']
+
+
+def store_to_panel(store_dir=None):
+    """ Returns the returns in the store as a panel of returns, i.e., in the
+    same format as the output of `week10_slides_main.step2_panel`
+    """
+    ret_mat, mkt, dates, tickers, ret_type = open_store(store_dir)
+    ret_mat = pd.DataFrame(np.asarray(ret_mat), index=dates, columns=tickers)
+    df = es.matrix_to_panel(ret_mat, pd.Series(mkt, index=dates))
+    df.attrs['ret_type'] = ret_type
+    return df
+
+
+def _block_cars(ret_mat, mkt, start, exact, col, windows, before, after,
+        non_trading='next', method='car', ret_type='simple'):
+    """ Computes the abnormal returns of events from a block of rows of the
+    store around each event
+
+    Parameters
+    ----------
+    ret_mat, mkt : array
+        Stock returns (dates x tickers) and market returns (see
+        `open_store`)
+
+    start : array
+        First row of the store on or after each event date
+
+    exact : array
+        True if the date of the row `start` is the event date
+
+    col : array
+        Column of the ticker of each event
+
+    windows : list
+        A list of tuples (<first day>, <last day>) with the event windows
+
+    before, after : int
+        The block of each event holds the rows from `start - before` to
+        `start + after`
+
+    non_trading, method, ret_type
+        See `store_cars` and `week10_slides_main.calc_cars`
+
+    Returns
+    -------
+    tuple
+        A tuple (done, cars) where `done` is True for the events whose
+        block holds all the trading days needed (or reaches the edges of
+        the store) and `cars` is a dictionary {<car_col> : <array>} with the
+        abnormal returns (only valid if `done` is True)
+
+    """
+    n = len(mkt)
+    offsets = np.arange(-before, after + 1)
+    rows = start[:, None] + offsets[None, :]
+    inside = (rows >= 0) & (rows < n)
+    rows = np.clip(rows, 0, max(n - 1, 0))
+
+    # Only read the rows and columns needed from the mapped file
+    if len(start) > 0:
+        ret = ret_mat[rows, col[:, None]]
+        ab_mkt = mkt[rows]
+    else:
+        ret = ab_mkt = np.empty(rows.shape)
+    valid = inside & ~np.isnan(ret)
+
+    # Trading days of the ticker before the event date and on or after it.
+    # The event is placed if it is within the trading days of its ticker
+    n_before = valid[:, :before].sum(axis=1)
+    n_after = valid[:, before:].sum(axis=1)
+    on_day = exact & valid[:, before]
+    placed = (n_after > 0) & ((n_before > 0) | on_day)
+    if non_trading == 'next':
+        day0 = n_before
+    elif non_trading == 'prev':
+        day0 = n_before + on_day - 1
+    else:
+        # Events on non-trading days are dropped
+        day0 = n_before
+        placed = placed & on_day
+
+    # Rank of each trading day of the ticker in the block, relative to day 0
+    rank = np.cumsum(valid, axis=1) - 1 - day0[:, None]
+    first_row = start - before <= 0
+    last_row = start + after >= n - 1
+    lo_min = min(lo for lo, hi in windows)
+    hi_max = max(hi for lo, hi in windows)
+    done = (((n_after > 0) | last_row)
+            & ((n_before > 0) | on_day | first_row)
+            & (~placed
+                | ((first_row | (day0 + lo_min >= 0))
+                    & (last_row | (day0 + hi_max <= valid.sum(axis=1) - 1)))))
+
+    if method == 'bhar':
+        # Returns of -100% are flagged and their log growth set to 0
+        ret, wiped_ret = es._log_growth(ret, ret_type)
+        ab_mkt, wiped_mkt = es._log_growth(ab_mkt, ret_type)
+    # Non-finite returns only affect the windows that include them
+    bad = valid & ~(np.isfinite(ret) & np.isfinite(ab_mkt))
+    ret = np.where(valid & ~bad, ret, 0.0)
+    ab_mkt = np.where(valid & ~bad, ab_mkt, 0.0)
+
+    cars = {}
+    for lo, hi in windows:
+        in_win = valid & (rank >= lo) & (rank <= hi)
+        nobs = in_win.sum(axis=1)
+        sum_ret = np.where(in_win, ret, 0.0).sum(axis=1)
+        sum_mkt = np.where(in_win, ab_mkt, 0.0).sum(axis=1)
+        if method == 'bhar':
+            gross_ret = np.expm1(sum_ret)
+            gross_ret[(in_win & wiped_ret).any(axis=1)] = -1.0
+            gross_mkt = np.expm1(sum_mkt)
+            gross_mkt[(in_win & wiped_mkt).any(axis=1)] = -1.0
+            car = gross_ret - gross_mkt
+        else:
+            car = sum_ret - sum_mkt
+        car[~placed | (nobs <= 0) | (in_win & bad).any(axis=1)] = np.nan
+        cars[es.car_col((lo, hi), method=method)] = car
+    return done, cars
+
+
+def store_cars(event_df, store_dir=None, windows=((-2, 2),),
+        non_trading='next', method='car'):
+    """ Compute the abnormal returns (market-adjusted model) of every event
+    in `event_df` from the returns in the store
+
+    Event windows are measured in the trading days of the ticker of each
+    event, i.e., the rows of the return matrix where the ticker has a return
+    (not NaN), so the CARs are the same as those of
+    `week10_slides_main.calc_cars` on the panel of returns. The returns in
+    the windows of all the events are gathered from the mapped file at once,
+    as an (events x days) matrix. Events whose window spans gaps in the
+    returns of their ticker are gathered again with a wider block of rows.
+
+    Parameters
+    ----------
+    event_df : data frame
+        A data frame with the events of interest (output of `step3_panel`)
+
+    store_dir : str, optional
+        Location of the store. Default is `STORE_DIR`
+
+    windows : list, optional
+        A list of tuples (<first day>, <last day>) with the event windows.
+        Default is [(-2, 2)]
+
+    non_trading : str, optional
+        How to deal with events on non-trading days. See
+        `week10_slides_main.event_positions`
+
+    method : str, optional
+        "car" (default) or "bhar". See `week10_slides_main.calc_cars`
+
+    Returns
+    -------
+    data frame
+        A data frame with one column per window (named by
+        `week10_slides_main.car_col`) and the same index as `event_df`. The
+        value is NaN if the ticker is not in the store, if the event could
+        not be placed (e.g. the event date is outside the trading days of
+        its ticker) or if the window has no returns.
+
+    """
+    if method not in ('car', 'bhar'):
+        raise Exception(f'Unknown value for `method`: {method}')
+    if non_trading not in ('next', 'prev', 'drop'):
+        raise Exception(f'Unknown value for `non_trading`: {non_trading}')
+    for lo, hi in windows:
+        if lo > hi:
+            raise Exception(f'Invalid event window: {(lo, hi)}')
+    ret_mat, mkt, dates, tickers, ret_type = open_store(store_dir)
+    n = len(dates)
+
+    # First row on or after each event date
+    days = pd.to_datetime(event_df.loc[:, 'event_date']).to_numpy()
+    days = days.astype('datetime64[ns]')
+    cal = dates.to_numpy().astype('datetime64[ns]')
+    start = np.searchsorted(cal, days, side='left')
+    exact = (start < n) & (cal[np.minimum(start, max(n - 1, 0))] == days)
+    col = tickers.get_indexer(event_df.loc[:, 'ticker'].str.lower())
+
+    cars = {es.car_col(window, method=method): np.full(len(event_df), np.nan)
+            for window in windows}
+    # The block of rows of each event covers the widest window, and is
+    # doubled for the events whose window spans gaps in the returns
+    todo = np.flatnonzero(col >= 0)
+    before = max(0, -min(lo for lo, hi in windows)) + 1
+    after = max(0, max(hi for lo, hi in windows)) + 1
+    while len(todo) > 0:
+        done, block = _block_cars(ret_mat, mkt, start[todo], exact[todo],
+                col[todo], windows, before, after, non_trading=non_trading,
+                method=method, ret_type=ret_type)
+        for key, car in block.items():
+            cars[key][todo[done]] = car[done]
+        todo = todo[~done]
+        before, after = 2 * before, 2 * after
+    return pd.DataFrame(cars, index=event_df.index)